@@ -0,0 +1,445 @@
+"""
+    Benchmarks of the PilPlus operations on synthetic images of several sizes and modes.
+
+    Every case is timed a few times on a fresh image (the setup is not timed) and the median is kept, with the throughput
+    in megapixels per second and the peak memory of one more run in a forked process (so PIL's own buffers are counted).
+    Everything is generated locally, nothing is downloaded.
+
+        python benchmarks/benchmark.py                                  # everything, prints a table
+        python benchmarks/benchmark.py --sizes 256 1k --modes RGB       # a subset
+        python benchmarks/benchmark.py --filter "resize|save"           # cases matching a regular expression
+        python benchmarks/benchmark.py --save-baseline baseline.json    # store the results
+        python benchmarks/benchmark.py --baseline baseline.json --threshold 0.2
+            # compare with stored results, exits with status 1 if a case is more than 20% slower
+        python benchmarks/benchmark.py --import-time --import-budget 0.25
+            # time `import pil_plus` in fresh interpreters, exits with status 1 if over budget or a heavy module got imported
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+
+from pil_plus import PilPlus, composite_alpha
+
+
+SIZES = {
+    "256": (256, 256),
+    "1k": (1024, 1024),
+    "hd": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+
+MODES = ("L", "RGB", "RGBA")
+COLOR_MODES = ("RGB", "RGBA")
+
+# modules `import pil_plus` and the plain PIL path (open, resize, base64) must not import
+HEAVY_MODULES = ("numpy", "cv2", "matplotlib")
+
+# run in a fresh interpreter: prints the import time, then the heavy modules loaded after importing and after the plain PIL path
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import pil_plus
+elapsed = time.perf_counter() - start
+heavy = %r
+print(elapsed)
+print(" ".join(m for m in heavy if m in sys.modules))
+from PIL import Image
+img = pil_plus.PilPlus(Image.new("RGB", (640, 480), (10, 200, 30)))
+img.resize(100)
+img.return_base64()
+print(" ".join(m for m in heavy if m in sys.modules))
+""" % (HEAVY_MODULES,)
+
+
+def make_image(size: tuple, mode: str, seed: int = 0) -> np.ndarray:
+    """
+        Synthetic image: smooth random colors with a few flat shapes, so that encoders and color matching
+        behave like on photos and graphics rather than on noise. Always the same for the same arguments
+
+        @param size: tuple(width, height)
+        @param mode: str
+            "L", "RGB" or "RGBA"
+        @param seed: int
+        @return: np.ndarray
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+
+    channels = {"L": 1, "RGB": 3, "RGBA": 4}[mode]
+    small = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), channels), dtype=np.uint8)
+
+    img = np.stack([np.asarray(Image.fromarray(small[..., c]).resize(size, Image.BICUBIC)) for c in range(channels)], axis=2)
+
+    # flat areas: black, white and pure red blocks (transparent in RGBA)
+    img[height // 8:height // 4, width // 8:width // 2] = 0
+    img[height // 2:height * 5 // 8, width // 4:width * 3 // 4] = 255
+    if channels >= 3:
+        img[height * 3 // 4:height * 7 // 8, width // 2:width * 7 // 8, :3] = (255, 0, 0)
+    if channels == 4:
+        img[height * 3 // 4:height * 7 // 8, width // 2:width * 7 // 8, 3] = 0
+
+    return np.ascontiguousarray(img[..., 0] if channels == 1 else img)
+
+
+def _resize_sharpen_base64(img: PilPlus):
+    img.resize(img.get_width() // 2)
+    img.sharpen()
+
+    return img.return_base64("JPEG", quality=85)
+
+
+def _small_sharpen_base64(img: PilPlus):
+    img.resize(200)
+    img.sharpen()
+
+    return img.return_base64("JPEG", quality=85)
+
+
+def _native_color_ops(img: PilPlus):
+    img.replace_color((255, 0, 0), (0, 0, 255))
+    img.sharpen()
+    img.rgb_to_bgr()
+    img.convert_to_grayscale()
+
+    return img.get_numpy_array(copy=False)
+
+
+def _thumbnail_base64(img: PilPlus):
+    img.resize(200)
+
+    return img.return_base64("JPEG", quality=85)
+
+
+# name: (modes it runs on, function of (image, context)). The image is a fresh PilPlus of the synthetic image,
+# the context has the synthetic array, its encoded files and a temporary directory
+CASES = {
+    "resize_half": (MODES, lambda img, ctx: img.resize(img.get_width() // 2)),
+    "resize_thumbnail": (MODES, lambda img, ctx: img.resize(200)),
+    "resize_double": (MODES, lambda img, ctx: img.resize(img.get_width() * 2)),
+    "rotate_45": (MODES, lambda img, ctx: img.rotate(45)),
+    "sharpen": (MODES, lambda img, ctx: img.sharpen()),
+    "gaussian_blur_pil": (MODES, lambda img, ctx: img.apply_gaussian_blur()),
+    "gaussian_blur_box_50": (MODES, lambda img, ctx: img.apply_gaussian_blur(50, backend="box")),
+    "gaussian_blur_cv2_50_downscale": (MODES, lambda img, ctx: img.apply_gaussian_blur(50, backend="cv2", downscale=True)),
+    "convert_to_grayscale": (MODES, lambda img, ctx: img.convert_to_grayscale()),
+    "convert_to_rgb": (("L", "RGBA"), lambda img, ctx: img.convert_to_rgb()),
+    "rgb_to_bgr": (COLOR_MODES, lambda img, ctx: img.rgb_to_bgr()),
+    "bgr_to_rgb": (COLOR_MODES, lambda img, ctx: img.bgr_to_rgb()),
+    "apply_background": (("RGBA",), lambda img, ctx: img.apply_background((255, 255, 255))),
+    "composite_alpha_stack_4": (("RGBA",), lambda img, ctx: composite_alpha(ctx["stack"], (255, 255, 255))),
+    "fill": (("RGB",), lambda img, ctx: img.fill((10, 20, 30))),
+    "replace_color": (COLOR_MODES, lambda img, ctx: img.replace_color((255, 0, 0), (0, 0, 255))),
+    "replace_colors": (COLOR_MODES, lambda img, ctx: img.replace_colors({(255, 0, 0): (0, 0, 255), (0, 0, 0): (255, 255, 255)})),
+    "replace_colors_tolerance": (("RGB",), lambda img, ctx: img.replace_colors({(255, 0, 0): (0, 0, 255)}, tolerance=10)),
+    "copy_pixels_from": (("RGB",), lambda img, ctx: img.copy_pixels_from(ctx["mask"], (255, 255, 255))),
+    "get_canny_edges": (MODES, lambda img, ctx: img.get_canny_edges()),
+    "draw_text": (MODES, lambda img, ctx: img.draw_text("pil_plus benchmark", ctx["black"])),
+    "draw_texts_labels": (MODES, lambda img, ctx: img.draw_texts([("pil_plus benchmark", ctx["black"]), ("label", ctx["black"], (10, 10)),
+                                                                 ("(c) pil_plus", ctx["black"], (10, 40))])),
+    "get_numpy_array": (MODES, lambda img, ctx: img.get_numpy_array()),
+    "copy": (MODES, lambda img, ctx: img.copy()),
+    "save_png": (MODES, lambda img, ctx: img.save(os.path.join(ctx["directory"], "out.png"), replace_file=True)),
+    "save_jpeg": (MODES, lambda img, ctx: img.save(os.path.join(ctx["directory"], "out.jpg"), replace_file=True, quality=85)),
+    "return_base64_jpeg": (MODES, lambda img, ctx: img.return_base64("JPEG")),
+    "return_base64_png": (MODES, lambda img, ctx: img.return_base64("PNG")),
+    "encode_webp": (MODES, lambda img, ctx: img.encode("WEBP")),
+
+    # common chains, from the encoded file
+    "open_jpeg": (("L", "RGB"), lambda img, ctx: PilPlus(BytesIO(ctx["jpeg"])).get_numpy_array(copy=False)),
+    "open_png": (MODES, lambda img, ctx: PilPlus(BytesIO(ctx["png"])).get_numpy_array(copy=False)),
+    "chain_thumbnail_base64": (("L", "RGB"), lambda img, ctx: _thumbnail_base64(PilPlus(BytesIO(ctx["jpeg"])))),
+    "chain_resize_sharpen_base64": (("L", "RGB"), lambda img, ctx: _resize_sharpen_base64(PilPlus(BytesIO(ctx["jpeg"])))),
+    "chain_resize_sharpen_base64_lazy": (("L", "RGB"), lambda img, ctx: _resize_sharpen_base64(PilPlus(BytesIO(ctx["jpeg"]), lazy=True))),
+    "thumbnail": (("L", "RGB"), lambda img, ctx: PilPlus(BytesIO(ctx["jpeg"])).thumbnail(img.get_width() // 2, quality=85)),
+    "chain_small_sharpen_base64_native": (MODES, lambda img, ctx: _small_sharpen_base64(PilPlus(ctx["array"], native_array=True))),
+    "thumbnail_small_native": (MODES, lambda img, ctx: PilPlus(ctx["array"], native_array=True).thumbnail(200, quality=85)),
+    "chain_native_color_ops": (("RGB",), lambda img, ctx: _native_color_ops(PilPlus(ctx["array"], native_array=True))),
+}
+
+
+def make_context(size_name: str, mode: str, directory: str) -> dict:
+    """
+        Inputs shared by the cases of a size and mode
+
+        @return: dict
+    """
+    array = make_image(SIZES[size_name], mode)
+
+    jpeg, png = BytesIO(), BytesIO()
+    Image.fromarray(array).convert("RGB" if mode == "RGBA" else mode).save(jpeg, "JPEG", quality=90)
+    Image.fromarray(array).save(png, "PNG")
+
+    return {
+        "array": array,
+        "mask": PilPlus(make_image(SIZES[size_name], "RGB", seed=1)) if mode == "RGB" else None,
+        "jpeg": jpeg.getvalue(),
+        "png": png.getvalue(),
+        "directory": directory,
+        "black": 0 if mode == "L" else (0, 0, 0),
+        # N x H x W x 4 stack for the batch compositing case
+        "stack": np.stack([array] * 4) if mode == "RGBA" else None,
+    }
+
+
+def time_case(function, ctx: dict, repeat: int, min_time: float) -> list:
+    """
+        Runs a case at least `repeat` times, and more (up to 5 times `repeat`) while the total is under `min_time` seconds
+
+        @return: list
+            seconds of each run
+    """
+    times = []
+
+    while len(times) < repeat or (sum(times) < min_time and len(times) < 5 * repeat):
+        img = PilPlus(ctx["array"])
+
+        start = time.perf_counter()
+        function(img, ctx)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def _current_rss() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure_peak_memory(function, ctx: dict) -> float:
+    """
+        Peak memory used by one run of a case, in MB. On linux the run is done in a forked process, whose highest resident size
+        above the one it started with includes native buffers (PIL, opencv). Elsewhere only what tracemalloc sees is counted
+
+        @return: float
+    """
+    if hasattr(os, "fork") and os.path.exists("/proc/self/statm"):
+        import resource
+
+        read, write = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            os.close(read)
+            peak = -1
+
+            try:
+                img = PilPlus(ctx["array"])
+                start = _current_rss()
+                function(img, ctx)
+                # ru_maxrss is in kilobytes on linux
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start
+            finally:
+                os.write(write, str(peak).encode())
+                os._exit(0)
+
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            peak = int(pipe.read() or -1)
+        os.waitpid(pid, 0)
+
+        return None if peak < 0 else max(0, peak) / 1e6
+
+    img = PilPlus(ctx["array"])
+
+    tracemalloc.start()
+    try:
+        function(img, ctx)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes, modes, pattern, repeat, min_time, memory) -> list:
+    """
+        Runs the selected cases
+
+        @return: list
+            a dict per case, size and mode
+    """
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size_name in sizes:
+            for mode in modes:
+                ctx = make_context(size_name, mode, directory)
+                width, height = SIZES[size_name]
+
+                for name, (case_modes, function) in CASES.items():
+                    if mode not in case_modes or (pattern and not re.search(pattern, name)):
+                        continue
+
+                    result = {"case": name, "size": size_name, "mode": mode, "width": width, "height": height}
+
+                    try:
+                        times = time_case(function, ctx, repeat, min_time)
+                    except Exception as error:
+                        result["error"] = repr(error)
+                    else:
+                        median = statistics.median(times)
+
+                        result.update({
+                            "runs": len(times),
+                            "median_s": median,
+                            "min_s": min(times),
+                            "mp_per_s": width * height / 1e6 / median if median > 0 else None,
+                            "peak_mb": measure_peak_memory(function, ctx) if memory else None,
+                        })
+
+                    results.append(result)
+                    print_result(result)
+
+    return results
+
+
+def print_result(result: dict) -> None:
+    label = "%-34s %-5s %-5s" % (result["case"], result["size"], result["mode"])
+
+    if "error" in result:
+        print(label, "error:", result["error"])
+        return
+
+    peak = "" if result["peak_mb"] is None else "%10.1f MB" % result["peak_mb"]
+    print(label, "%10.2f ms %10.1f MP/s" % (1000 * result["median_s"], result["mp_per_s"] or 0), peak)
+
+
+def get_environment() -> dict:
+    import cv2
+    import PIL
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def measure_import_time(repeat: int = 7) -> dict:
+    """
+        Time of `import pil_plus` in fresh interpreters (the median of `repeat` of them), and the heavy modules it imported
+
+        @return: dict
+            seconds, and the heavy modules loaded right after importing and after resizing and encoding with PIL only
+    """
+    times = []
+    loaded = {"after_import": set(), "after_resize": set()}
+
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError("The import check failed:\n" + process.stderr)
+
+        elapsed, after_import, after_resize = (process.stdout.splitlines() + ["", ""])[:3]
+
+        times.append(float(elapsed))
+        loaded["after_import"].update(after_import.split())
+        loaded["after_resize"].update(after_resize.split())
+
+    return {"import_s": statistics.median(times), **{key: sorted(value) for key, value in loaded.items()}}
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """
+        Outputs the cases slower than in the baseline by more than `threshold` (a fraction, 0.2 is 20%)
+
+        @return: list
+            (result, baseline median) pairs
+    """
+    previous = {(r["case"], r["size"], r["mode"]): r for r in baseline["results"] if "median_s" in r}
+    regressions = []
+
+    for result in results:
+        before = previous.get((result["case"], result["size"], result["mode"]))
+
+        if before is None or "median_s" not in result:
+            continue
+
+        if result["median_s"] > before["median_s"] * (1 + threshold):
+            regressions.append((result, before["median_s"]))
+
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the PilPlus operations")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--filter", help="regular expression the case names must match")
+    parser.add_argument("--repeat", type=int, default=3, help="minimum number of timed runs per case")
+    parser.add_argument("--min-time", type=float, default=0.5, help="more runs are done until a case took this many seconds")
+    parser.add_argument("--no-memory", action="store_true", help="don't measure the peak memory")
+    parser.add_argument("--quick", action="store_true", help="256 and 1k only, one run per case, no memory")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--save-baseline", help="write the results to this json file, to be used with --baseline")
+    parser.add_argument("--baseline", help="json file of previous results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown (fraction) over the baseline counted as a regression")
+    parser.add_argument("--list", action="store_true", help="list the cases")
+    parser.add_argument("--import-time", action="store_true", help="only check the time of `import pil_plus` (see --import-budget)")
+    parser.add_argument("--import-budget", type=float, default=0.25, help="seconds `import pil_plus` may take")
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        measured = measure_import_time()
+        print("import pil_plus: %.1f ms (budget %.1f ms)" % (1000 * measured["import_s"], 1000 * args.import_budget))
+        print("heavy modules after import: %s" % (" ".join(measured["after_import"]) or "none"))
+        print("heavy modules after resize and base64: %s" % (" ".join(measured["after_resize"]) or "none"))
+
+        return int(measured["import_s"] > args.import_budget or bool(measured["after_import"] or measured["after_resize"]))
+
+    if args.list:
+        for name, (modes, _) in CASES.items():
+            print("%-34s %s" % (name, " ".join(modes)))
+        return 0
+
+    if args.quick:
+        args.sizes = [size for size in args.sizes if size in ("256", "1k")]
+        args.repeat, args.min_time, args.no_memory = 1, 0, True
+
+    results = run(args.sizes, args.modes, args.filter, args.repeat, args.min_time, not args.no_memory)
+    report = {"environment": get_environment(), "results": results}
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if baseline.get("environment") != report["environment"]:
+            print("\nwarning: the baseline was measured in another environment:", baseline.get("environment"))
+
+        regressions = compare(results, baseline, args.threshold)
+
+        print("\n%d regression(s) over %d%%" % (len(regressions), round(100 * args.threshold)))
+        for result, before in regressions:
+            print("  %-34s %-5s %-5s %10.2f ms -> %10.2f ms" % (result["case"], result["size"], result["mode"], 1000 * before, 1000 * result["median_s"]))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
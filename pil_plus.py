@@ -1,25 +1,272 @@
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import matplotlib.pyplot as plt
+from __future__ import annotations
+
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageFile
 import os
-import subprocess
+import sys
+import math
+import importlib
 
 import base64
+import binascii
+import re
+from urllib.parse import unquote_to_bytes
 from io import BytesIO
+from collections import deque, namedtuple, OrderedDict
+from abc import ABC, abstractmethod
+from functools import lru_cache, wraps
+import inspect
+import threading
+import glob
+import itertools
+import traceback
+import pickle
+from concurrent.futures import FIRST_COMPLETED, wait
+import weakref
+import hashlib
+import json
+import time
+import tracemalloc
+import csv
+
+
+class _LazyModule():
+    """
+        Internal class standing for a module that is only imported when first used, so that `import pil_plus` stays fast.
+        Once imported, the module replaces it in this module's globals
+    """
+
+    def __init__(self, name: str, alias: str) -> None:
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+
+        return getattr(module, attribute)
+
+
+# heavy dependencies, imported by the first operation that needs them (matplotlib only for save's preview)
+np = _LazyModule("numpy", "np")
+cv2 = _LazyModule("cv2", "cv2")
+plt = _LazyModule("matplotlib.pyplot", "plt")
+asyncio = _LazyModule("asyncio", "asyncio")
+
+
+def _is_numpy(value, kind: str = "ndarray") -> bool:
+    """
+        Internal function, isinstance(value, np.<kind>) without importing numpy: nothing is a numpy object before numpy is imported
+
+        @param value:
+        @param kind: str
+            name of the numpy type
+        @return: bool
+    """
+    numpy = sys.modules.get("numpy")
+
+    return numpy is not None and isinstance(value, getattr(numpy, kind))
 
 
 BLANK = "blank"
 
+# encoding buffers reused by return_base64, one per thread
+_encode_buffers = threading.local()
+
+# a thread's encoding buffer grown above this size by a large image is dropped after the call instead of being kept
+ENCODE_BUFFER_LIMIT = 16 * 1024 * 1024
+
+# used by setImage to tell base64 text from paths and encoded image bytes without touching the file system
+_BASE64_TEXT = re.compile(r"[A-Za-z0-9+/=_\-\s]*")
+_BASE64_BYTES = re.compile(rb"[A-Za-z0-9+/=_\-\s]*")
+_MAX_PATH_LENGTH = 4096
+
+# url-safe base64 has "-" and "_" instead of "+" and "/", which a2b_base64 would silently skip
+_URL_SAFE_BYTES = re.compile(rb"[-_]")
+_URL_SAFE_TEXT_TABLE = str.maketrans("-_", "+/")
+_URL_SAFE_BYTES_TABLE = bytes.maketrans(b"-_", b"+/")
+
+# netpbm headers (P1 to P7) are ascii, so the start of such a file could pass for base64
+_NETPBM_MAGIC = re.compile(rb"P[1-7]\s")
+
+# font bundled with the package
+DEFAULT_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arial.ttf")
+
+
+def load_font(path: str = None, size: int = 12, index: int = 0) -> ImageFont.FreeTypeFont:
+    """
+        Loads a truetype font. Fonts are cached per (path, size, index) for the whole process, so loading the same font again is free.
+
+        @param path: str
+            path of the font file. Default is the bundled arial.ttf
+        @param size: int
+        @param index: int
+            which font face to load from the file
+        @return: PIL.ImageFont.FreeTypeFont
+    """
+    if path is None:
+        path = DEFAULT_FONT_PATH
+
+    return _load_font(path, size, index)
+
+
+@lru_cache(maxsize=64)
+def _load_font(path: str, size: int, index: int) -> ImageFont.FreeTypeFont:
+    # lru_cache keeps its bookkeeping consistent across threads
+    return ImageFont.truetype(path, size=size, index=index)
+
+
+TextItem = namedtuple("TextItem", ["text", "color", "position", "font", "anchor"], defaults=((0, 0, 0), None, None, None))
+TextItem.__doc__ = """
+    One text for PilPlus.draw_texts
+
+    text: str, may have several lines
+    color: color of the text, e.g. (0, 0, 0) for rgb or 0 for grayscale images. Default is black
+    position: (x, y) of the anchor in whole pixels, None to center the text in the image
+    font: ImageFont. Default is Arial with size 12, see load_font
+    anchor: PIL text anchor, e.g. "la" (left, ascender, the default) or "mm" (middle)
+"""
+
+
+@lru_cache(maxsize=1024)
+def _render_text(text: str, font: ImageFont.FreeTypeFont, anchor: str = None) -> tuple:
+    """
+        Internal function rasterizing a text once for draw_texts. Fonts are compared by identity, the ones from load_font
+        are cached so the same font is the same object.
+
+        @param text: str
+        @param font: ImageFont
+        @param anchor: str
+        @return: tuple(PIL.Image, tuple(int, int))
+            antialiased mask of the text, and its offset from the anchor
+    """
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font, anchor=anchor)
+
+    # e.g. centered lines of multiline text start half way through a pixel, which the mask keeps at the same fraction
+    left, top, right, bottom = math.floor(left), math.floor(top), math.ceil(right), math.ceil(bottom)
+
+    mask = Image.new("L", (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font, anchor=anchor)
+
+    return mask, (left, top)
+
+
+@lru_cache(maxsize=2)
+def _near_color_table(sources: tuple, tolerance: float, metric: str) -> np.ndarray:
+    """
+        Internal function building the lookup table of PilPlus._build_near_color_table
+
+        @param sources: tuple
+            source colors, a tuple of channel values each
+        @param tolerance: int or float
+        @param metric: str
+        @return: np.ndarray
+    """
+    sources = np.array(sources, dtype=np.int64)
+    channels = sources.shape[1]
+    reach = int(tolerance)
+    limit = tolerance if metric == "channel" else tolerance ** 2
+
+    table = np.full((256,) * channels, -1, dtype=np.int32)
+    best_distance = np.full((256,) * channels, np.inf, dtype=np.float32)
+
+    # only the cube of colors around each source color can be within tolerance
+    for i, source in enumerate(sources):
+        cube = tuple(slice(max(0, value - reach), min(255, value + reach) + 1) for value in source)
+        axes = np.ogrid[cube]
+
+        if metric == "channel":
+            distance = np.abs(axes[0] - source[0])
+            for axis, value in zip(axes[1:], source[1:]):
+                distance = np.maximum(distance, np.abs(axis - value))
+        else:
+            # squared distances are exact integers, no rounding when comparing them
+            distance = (axes[0] - source[0]) ** 2
+            for axis, value in zip(axes[1:], source[1:]):
+                distance = distance + (axis - value) ** 2
+
+        closer = (distance <= limit) & (distance < best_distance[cube])
+        best_distance[cube][closer] = distance[closer]
+        table[cube][closer] = i
+
+    # shared by every image using the same colors
+    table = table.ravel()
+    table.flags.writeable = False
+
+    return table
+
+
 class PilPlus():
 
-    img = None
     BLANK = "blank"
 
-    def __init__(self, img, size=None) -> None:
+    # the image is stored either as a PIL image or, in native array mode, as a contiguous numpy array.
+    # whichever was written last is the canonical one, the other one is only a cache derived from it
+    _img = None
+    _array = None
+    _array_owned = False
+    native_array = False
+
+    # lazy mode, see run_pending
+    lazy = False
+    _pending = ()
+    _running = False
+
+    # see resize
+    reduce_on_load = True
+    _opened = False
+
+    # resampling filter of resize and thumbnail, e.g. Image.BICUBIC (faster) instead of the default Image.LANCZOS
+    resample = Image.LANCZOS
+
+    def __init__(self, img, size=None, native_array=False, lazy=False, reduce_on_load=True) -> None:
+        """
+            @param img: str, np.ndarray, PIL.Image or PilPlus
+                path, base64 string, array or image to open. Use PilPlus.BLANK and `size` for a blank white image
+            @param size: tuple
+                size of the blank image
+            @param native_array: bool
+                if True, keep the image as a numpy array between operations and only create a PIL image for PIL only
+                operations (resize, rotate, draw_text...), which saves a copy or two per numpy/opencv based operation
+            @param lazy: bool
+                if True, operations like resize, sharpen or color conversions are only recorded and run (optimized) when the pixels
+                are needed, e.g. by get_image, save or return_base64. See run_pending
+            @param reduce_on_load: bool
+                if True, a jpeg that is downscaled before anything else reads its pixels is decoded at a reduced size (see resize)
+        """
+        self.native_array = native_array
+        self.lazy = lazy
+        self.reduce_on_load = reduce_on_load
+        self._pending = []
+
         self.setImage(img, size)
 
-        self.arial_font = ImageFont.truetype("arial.ttf", size=12)
+    @property
+    def arial_font(self) -> ImageFont.FreeTypeFont:
+        """
+            Default font of draw_text, Arial with size 12. Only loaded when first used.
+        """
+        return load_font(DEFAULT_FONT_PATH, size=12)
+
+    @property
+    def img(self) -> Image:
+        if self._pending:
+            self.run_pending()
+
+        if self._img is None and self._array is not None:
+            # native array mode, the PIL image is only created when something needs it
+            self._img = Image.fromarray(self._array)
+
+        return self._img
+
+    @img.setter
+    def img(self, img):
+        self._img = img
+        self._array = None
+        self._array_owned = False
+        self._opened = False
+
+        # operations recorded for the previous image don't apply to the new one
+        self._pending = []
 
     def setImage(self, img, size=None):
         if type(img) == str and img == BLANK:
@@ -30,20 +277,196 @@ class PilPlus():
 
             return
 
-        if type(img) == np.ndarray:
-            self.img = Image.fromarray(img)
-        elif type(img) == Image.Image:
+        if _is_numpy(img):
+            if self.native_array:
+                self._set_array(img, owned=False)
+            else:
+                self.img = Image.fromarray(img)
+        elif isinstance(img, Image.Image):
             self.img = img
-        elif type(img) == PilPlus:
-            self.img = img.get_image()
+        elif isinstance(img, PilPlus):
+            img.run_pending()
+
+            if self.native_array and img._array is not None:
+                # shared buffer, neither object may change it in place anymore
+                img._array_owned = False
+                self._set_array(img._array, owned=False)
+            elif self.native_array:
+                # not decoded into an array yet: the drawing functions would change the other object's PIL image
+                self.img = img.get_image().copy()
+            else:
+                self.img = img.get_image()
         else:
-            try:
-                # open image from path
-                self.img = Image.open(img)
-            except FileNotFoundError as e:
-                # maybe it's a base64 string instead of a path
-                buff = BytesIO(base64.b64decode(img))
-                self.img = Image.open(buff)
+            self.img = Image.open(self._get_source(img))
+
+            # not decoded yet, and not used outside of this object
+            self._opened = True
+
+    def _get_source(self, img):
+        """
+            Internal function for turning what setImage was given into something PIL.Image.open accepts, without trying (and failing) 
+            to open base64 data as a path.
+
+            @param self:
+            @param img: str, os.PathLike, bytes, bytearray, memoryview or file-like object
+                path, base64 text, data url, encoded image bytes (or their base64) or an open file
+            @return: str, os.PathLike or file-like object
+        """
+        if hasattr(img, "read") or isinstance(img, os.PathLike):
+            return img
+
+        if isinstance(img, (bytes, bytearray, memoryview)):
+            data = memoryview(img).cast("B")
+
+            if data[:5] == b"data:":
+                return self._decode_data_url(data)
+
+            start = data[:64].tobytes()
+
+            if _NETPBM_MAGIC.match(start) is not None or _BASE64_BYTES.fullmatch(start) is None:
+                # encoded image, BytesIO shares the memory of a bytes object
+                return BytesIO(img if isinstance(img, bytes) else data)
+
+            # base64 of an image (e.g. from return_base64), decoded straight from the buffer
+            return self._decode_base64(data)
+
+        if isinstance(img, str):
+            if img.startswith("data:"):
+                return self._decode_data_url(img)
+
+            # nothing longer than a path can be is a path, and a path that exists wins over base64 look-alikes
+            if len(img) > _MAX_PATH_LENGTH or (_BASE64_TEXT.fullmatch(img) is not None and not os.path.exists(img)):
+                return self._decode_base64(img)
+
+        return img
+
+    def _decode_base64(self, data):
+        """
+            Internal function for decoding base64 text, standard or url-safe
+
+            @param self:
+            @param data: str or memoryview
+            @return: BytesIO
+        """
+        if isinstance(data, str):
+            if "-" in data or "_" in data:
+                data = data.translate(_URL_SAFE_TEXT_TABLE)
+        elif _URL_SAFE_BYTES.search(data) is not None:
+            data = data.tobytes().translate(_URL_SAFE_BYTES_TABLE)
+
+        # a2b_base64 reads ascii text as it is, b64decode would copy it into bytes first
+        return BytesIO(binascii.a2b_base64(data))
+
+    def _decode_data_url(self, data):
+        """
+            Internal function for decoding a data url (data:image/png;base64,...)
+
+            @param self:
+            @param data: str or memoryview
+            @return: BytesIO
+        """
+        if isinstance(data, str):
+            comma = data.find(",", 0, 1024)
+        else:
+            comma = data[:1024].tobytes().find(b",")
+
+        if comma == -1:
+            raise ValueError("invalid data url")
+
+        header = data[5:comma]
+        if not isinstance(header, str):
+            header = header.tobytes().decode("ascii")
+
+        payload = data[comma + 1:]
+
+        if header.endswith(";base64"):
+            return self._decode_base64(payload)
+
+        if not isinstance(payload, str):
+            payload = payload.tobytes().decode("ascii")
+
+        return BytesIO(unquote_to_bytes(payload))
+
+    def _get_array(self) -> np.ndarray:
+        """
+            Internal function for reading the image as a numpy array. In native array mode this is the stored buffer itself, 
+            so it must not be changed (see _writable_array)
+
+            @param self:
+            @return: np.ndarray
+        """
+        if self._pending:
+            self.run_pending()
+
+        if self._array is not None:
+            return self._array
+
+        array = np.asarray(self._img)
+
+        if self.native_array:
+            # keep it, the PIL image stays valid as it was not changed
+            self._array = array
+            self._array_owned = False
+
+        return array
+
+    def _writable_array(self) -> np.ndarray:
+        """
+            Internal function for getting an array of the image that can be changed in place and then passed to _set_array.
+            In native array mode the stored buffer is reused when nothing else can see it.
+
+            @param self:
+            @return: np.ndarray
+        """
+        if not self.native_array:
+            return np.array(self.img)
+
+        array = self._get_array()
+
+        # a PIL image made from the buffer (see img) may share its memory
+        if self._array_owned and self._img is None:
+            return array
+
+        return np.array(array)
+
+    def _set_array(self, img: np.ndarray, owned=True) -> None:
+        """
+            Internal function for replacing the image with a numpy array
+
+            @param self:
+            @param img: np.ndarray
+            @param owned: bool
+                False if the array may be used outside of this object, it is then copied before being changed in place
+            @return: None
+        """
+        if not self.native_array:
+            self.img = Image.fromarray(img)
+            return
+
+        array = np.ascontiguousarray(img)
+
+        self._img = None
+        self._array = array
+        self._array_owned = owned or array is not img
+        self._opened = False
+
+    def _get_mode(self) -> str:
+        """
+            Internal function for getting the PIL mode of the image without creating a PIL image in native array mode
+
+            @param self:
+            @return: str
+        """
+        if self._pending:
+            self.run_pending()
+
+        if self._img is not None or self._array is None:
+            return self._img.mode
+
+        if self._array.ndim == 2:
+            return "L"
+
+        return {3: "RGB", 4: "RGBA"}.get(self._array.shape[2], self.img.mode)
 
     def get_width(self) -> int:
         """
@@ -54,7 +477,7 @@ class PilPlus():
                 width of image
         """
         
-        return self.img.size[0]
+        return self.get_size()[0]
 
     def get_height(self) -> int:
         """
@@ -65,7 +488,7 @@ class PilPlus():
                 Height of the image
         """
         
-        return self.img.size[1]
+        return self.get_size()[1]
 
     def get_size(self):
         """
@@ -75,8 +498,27 @@ class PilPlus():
             @return: tuple(width, height)
         """
         
+        if self._pending:
+            self.run_pending()
+
+        if self._img is None and self._array is not None:
+            return (self._array.shape[1], self._array.shape[0])
+
         return self.img.size
 
+    def copy(self) -> 'PilPlus':
+        """
+            Outputs an independent copy of the image, e.g. for working on it from another thread.
+            In native array mode the pixels are only copied when one of the two images changes them
+
+            @param self:
+            @return: PilPlus
+        """
+        if self.native_array:
+            return PilPlus(self, native_array=True, lazy=self.lazy)
+
+        return PilPlus(self.img.copy(), lazy=self.lazy)
+
     def get_draw(self):
         """
             Outputs the ImageDraw for the image
@@ -85,9 +527,146 @@ class PilPlus():
             @return: PIL.ImageDraw
         """
         
-        return ImageDraw.Draw(self.img)        
+        # drawing changes the PIL image in place, so it becomes the canonical one
+        img = self.img
+        self.img = img
+
+        return ImageDraw.Draw(img)        
         
     
+    def _defer(self, name: str, *args, **kwargs) -> bool:
+        """
+            Internal function. In lazy mode, records the call of operation `name` instead of running it.
+
+            @param self:
+            @param name: str
+                name of the method
+            @return: bool
+                True if the operation was recorded and the method should return right away
+        """
+        if not self.lazy or self._running:
+            return False
+
+        self._pending.append((name, args, kwargs))
+
+        return True
+
+    def run_pending(self):
+        """
+            Runs the operations recorded in lazy mode. This is done automatically when the pixels are needed.
+            Before running, the recorded operations are optimized:
+            * conversions that don't change anything (e.g. convert_to_rgb of an rgb image) are dropped
+            * consecutive color swaps (rgb_to_bgr / bgr_to_rgb) cancel out
+            * consecutive downscaling resizes become a single resize
+            * resizes run before color swaps and gray to rgb conversions, and downscaling resizes before sharpen,
+              so those operations work on fewer pixels.
+            Resampling once instead of twice, and sharpening after downscaling (at the output resolution), give slightly
+            different pixels from running the calls one by one. The other rewrites give exactly the same result.
+
+            @param self:
+            @return: PilPlus
+                current PilPlus object
+        """
+        operations = self._pending
+        self._pending = []
+
+        if not operations:
+            return self
+
+        self._running = True
+
+        try:
+            for name, args, kwargs in self._optimize_operations(operations):
+                getattr(self, name)(*args, **kwargs)
+        finally:
+            self._running = False
+
+        return self
+
+    def _optimize_operations(self, operations: list) -> list:
+        """
+            Internal function for optimizing recorded operations (see run_pending). Follows the mode and size of the image through the operations
+            without touching any pixel.
+
+            @param self:
+            @param operations: list
+                (name, args, kwargs) tuples
+            @return: list
+                (name, args, kwargs) tuples to run
+        """
+        swaps = ("rgb_to_bgr", "bgr_to_rgb")
+
+        mode, size = self._get_mode(), self.get_size()
+
+        # size before the last recorded resize
+        resized_from = None
+
+        # (name, args, kwargs, mode before the operation)
+        result = []
+
+        for name, args, kwargs in operations:
+            if name == "convert_to_rgb":
+                if mode not in ("L", "RGBA"):
+                    continue
+
+                result.append((name, args, kwargs, mode))
+                mode = "RGB"
+            elif name == "convert_to_grayscale":
+                if result and result[-1][0] == name:
+                    # already gray
+                    continue
+
+                result.append((name, args, kwargs, mode))
+                mode = "RGB"
+            elif name == "apply_background":
+                if mode in ("RGB", "L"):
+                    # no alpha channel to apply the background to
+                    continue
+
+                result.append((name, args, kwargs, mode))
+                if mode == "RGBA":
+                    mode = "RGB"
+            elif name in swaps and result and result[-1][0] in swaps and result[-1][3] == "RGB":
+                # swapping red and blue twice (the first swap of an rgba image drops its alpha channel)
+                result.pop()
+            elif name == "resize":
+                arguments = inspect.signature(PilPlus.resize).bind(self, *args, **kwargs).arguments
+                new_size = self._resize_dimensions(size, arguments.get("new_width"), arguments.get("new_height"))
+                shrinking = new_size[0] * new_size[1] < size[0] * size[1]
+
+                position = len(result)
+                while position > 0:
+                    previous, _, _, previous_mode = result[position - 1]
+
+                    if (previous in swaps and previous_mode == "RGB") or (previous == "convert_to_rgb" and previous_mode == "L") \
+                            or (previous == "sharpen" and shrinking):
+                        position -= 1
+                    else:
+                        break
+
+                if position > 0 and result[position - 1][0] == "resize" and shrinking \
+                        and size[0] * size[1] < resized_from[0] * resized_from[1]:
+                    # two downscales, resample once from the size before the previous resize
+                    position -= 1
+                    result.pop(position)
+                else:
+                    resized_from = size
+
+                resize_mode = result[position][3] if position < len(result) else mode
+                result.insert(position, (name, (), {"new_width": new_size[0], "new_height": new_size[1], "resample": arguments.get("resample")},
+                                         resize_mode))
+                size = new_size
+            else:
+                result.append((name, args, kwargs, mode))
+
+                if name in swaps and mode == "RGBA":
+                    # opencv drops the alpha channel
+                    mode = "RGB"
+                elif name not in swaps + ("fill", "replace_color", "replace_colors", "sharpen", "rotate", "apply_gaussian_blur"):
+                    mode = None
+
+        return [(name, args, kwargs) for name, args, kwargs, _ in result]
+
     def convert_to_grayscale(self):
         """
             Converts the image to grayscale
@@ -96,8 +675,20 @@ class PilPlus():
             @return: self
                 current PilPlus object
         """
+
+        if self._defer("convert_to_grayscale"):
+            return self
         
-        self.img = Image.fromarray(cv2.cvtColor(np.asarray(self.img.convert('L')), cv2.COLOR_GRAY2RGB))
+        if self._array is None:
+            gray = np.asarray(self.img.convert('L'))
+        elif self._array.ndim == 2:
+            gray = self._array
+        else:
+            # same fixed point formula as PIL's convert('L')
+            channels = self._array.astype(np.uint32)
+            gray = ((channels[..., 0] * 19595 + channels[..., 1] * 38470 + channels[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+        self._set_array(cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB))
         
         return self
 
@@ -106,10 +697,16 @@ class PilPlus():
             Converts the image from bgr to rgb (opencv uses bgr)
 
             @param self:
-            @return: None
+            @return: PilPlus
+                current PilPlus object
         """
+
+        if self._defer("bgr_to_rgb"):
+            return self
         
-        self.img = Image.fromarray(cv2.cvtColor(np.asarray(self.img), cv2.COLOR_BGR2RGB))
+        self._set_array(cv2.cvtColor(self._get_array(), cv2.COLOR_BGR2RGB))
+
+        return self
 
     def convert_to_rgb(self):
         """
@@ -119,10 +716,16 @@ class PilPlus():
             @return: PilPlus
                 internally changes the image to rgb
         """
-        if self.img.mode == 'L':
-            self.img = Image.fromarray(cv2.cvtColor(np.asarray(self.img), cv2.COLOR_GRAY2RGB))
-        elif self.img.mode == 'RGBA':
-            self.img = Image.fromarray(cv2.cvtColor(np.asarray(self.img), cv2.COLOR_RGBA2RGB))
+
+        if self._defer("convert_to_rgb"):
+            return self
+
+        mode = self._get_mode()
+
+        if mode == 'L':
+            self._set_array(cv2.cvtColor(self._get_array(), cv2.COLOR_GRAY2RGB))
+        elif mode == 'RGBA':
+            self._set_array(cv2.cvtColor(self._get_array(), cv2.COLOR_RGBA2RGB))
 
         return self
 
@@ -131,28 +734,119 @@ class PilPlus():
             Converts the image from rgb to bgr (opencv uses bgr)
 
             @param self:
-            @return: None
+            @return: PilPlus
+                current PilPlus object
         """
+
+        if self._defer("rgb_to_bgr"):
+            return self
         
-        self.img = Image.fromarray(cv2.cvtColor(self.get_numpy_array(), cv2.COLOR_RGB2BGR))
+        self._set_array(cv2.cvtColor(self._get_array(), cv2.COLOR_RGB2BGR))
+
+        return self
 
 
     
 
-    def apply_gaussian_blur(self):
+    def apply_gaussian_blur(self, radius: float = 10, backend: str = "pil", downscale=None):
         """
             apply gaussian blur to the current image
 
             @param self:
-            @return: None
+            @param radius: float
+                standard deviation of the gaussian, in pixels
+            @param backend: str
+                "pil": PIL's GaussianBlur (3 box blurs)
+                "cv2": opencv's separable gaussian kernel, exact but slower for large radii
+                "box": 3 opencv box blurs, whose cost doesn't depend on the radius
+            @param downscale: bool or int
+                for large radii: blur the image downscaled by this factor and scale it back up. The result is smooth enough as long as
+                the radius stays above a few pixels at the small size. True picks the factor that brings the radius down to 8 pixels.
+                Default is no downscaling
+            @return: PilPlus
+                current PilPlus object
         """
-        
-        self.img = self.img.filter(ImageFilter.GaussianBlur(10))
+
+        if backend not in ("pil", "cv2", "box"):
+            raise ValueError("Unknown blur backend: " + str(backend))
+
+        if self._defer("apply_gaussian_blur", radius=radius, backend=backend, downscale=downscale):
+            return self
+
+        factor = _blur_downscale_factor(radius, downscale)
+
+        if backend == "pil" or self._get_mode() not in ("L", "RGB", "RGBA"):
+            img = self.img
+
+            if factor > 1:
+                small = img.resize((max(1, img.size[0] // factor), max(1, img.size[1] // factor)), Image.BOX)
+                self.img = small.filter(ImageFilter.GaussianBlur(radius / factor)).resize(img.size, Image.BILINEAR)
+            else:
+                self.img = img.filter(ImageFilter.GaussianBlur(radius))
+
+            return self
+
+        img = self._get_array()
+        height, width = img.shape[:2]
+
+        if factor > 1:
+            img = cv2.resize(img, (max(1, width // factor), max(1, height // factor)), interpolation=cv2.INTER_AREA)
+
+        blurred = self._blur_array(img, radius / factor, backend)
+
+        if factor > 1:
+            blurred = cv2.resize(blurred, (width, height), interpolation=cv2.INTER_LINEAR)
+
+        self._set_array(blurred)
+
+        return self
+
+    def _blur_array(self, img: np.ndarray, radius: float, backend: str) -> np.ndarray:
+        """
+            Internal function blurring an array with opencv. Edges are extended like PIL does
+
+            @param img: np.ndarray
+            @param radius: float
+                standard deviation
+            @param backend: str
+                "cv2" or "box"
+            @return: np.ndarray
+        """
+        if backend == "cv2":
+            return cv2.GaussianBlur(img, (0, 0), sigmaX=radius, sigmaY=radius, borderType=cv2.BORDER_REPLICATE)
+
+        for size in self._box_blur_sizes(radius):
+            img = cv2.blur(img, (size, size), borderType=cv2.BORDER_REPLICATE)
+
+        return img
+
+    def _box_blur_sizes(self, radius: float, passes: int = 3) -> list:
+        """
+            Internal function for the sizes of the box blurs whose succession has the variance of a gaussian of std. deviation `radius`.
+            Boxes have odd sizes, so some passes use the smaller and the others the larger odd size around the ideal one
+
+            @param radius: float
+            @param passes: int
+            @return: list
+        """
+        ideal = np.sqrt(12 * radius * radius / passes + 1)
+
+        lower = int(ideal)
+        if lower % 2 == 0:
+            lower -= 1
+        upper = lower + 2
+
+        # number of passes with the smaller box so that the variances add up
+        smaller = round((12 * radius * radius - passes * lower * lower - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+        smaller = min(passes, max(0, smaller))
+
+        return [lower] * smaller + [upper] * (passes - smaller)
 
     def apply_background(self, color):     
         """
             if current image has a transparent background (see remove_background function) then apply
             a specific color as a background.
+            An rgba image is pasted with its alpha channel as the mask directly (see composite_alpha), without splitting its bands.
 
             @param self:
             @param color: What color to use for the image.  Default is black.
@@ -161,23 +855,32 @@ class PilPlus():
                         per band).  When creating RGB images, you can also use color
                         strings as supported by the ImageColor module.  If the color is
                         None, the image is not initialized. 
+                        It can also be a background image of the same size (PIL image, PilPlus or numpy array).
             
-            @return: None
+            @return: PilPlus
+                current PilPlus object
         """
+
+        if self._defer("apply_background", color):
+            return self
         
-        if len(self.img.split()) == 4:
+        if self._get_mode() == "RGBA":
+            self.img = _composite_alpha_image(self.img, color)
+        elif len(self.img.getbands()) == 4:
             background = Image.new("RGB", self.img.size, color=color)
             background.paste(self.img, mask=self.img.split()[3]) # 3 is the alpha channel
 
             self.img = background
 
+        return self
+
     def draw_text(self, text: str, text_color: tuple, font:ImageFont = None, coordinates=(0,0)):
         """
         @param self:
         @param text: str
             Text to be written on the image.
         @param font: ImageFont
-            Font to use for the text. Default is Arial with size 12
+            Font to use for the text. Default is Arial with size 12. See load_font for loading (cached) fonts
         @param text_color: tuple
             Tuple containing RGB or RGBA color
         
@@ -189,64 +892,239 @@ class PilPlus():
         
         W, H = (self.get_width(), self.get_height())
 
-        self.draw = self.get_draw() 
+        draw = self.get_draw()
 
-        _, _, w, h = self.draw.textbbox(coordinates, text, font=font)
+        _, _, w, h = draw.textbbox(coordinates, text, font=font)
 
-        self.draw.text(((W-w)/2, (H-h)/2), text, font=font, fill=text_color)
+        draw.text(((W-w)/2, (H-h)/2), text, font=font, fill=text_color)
 
         return self.img
 
-    def resize(self, new_width: int = None, new_height: int = None):
+    def draw_texts(self, items: list):
+        """
+            Draws many texts at once, e.g. watermarks and labels. Each (text, font, anchor) is rasterized once per process,
+            later calls, on this image or any other one, only blend the cached mask with the color.
+
+                image.draw_texts([TextItem("sample", (255, 255, 255), (10, 10)), ("centered", (0, 0, 0))])
+
+            @param self:
+            @param items: list
+                TextItem, or tuples or dicts of its fields (text, color, position, font, anchor)
+
+            @return: PilPlus
+                current PilPlus object
+        """
+        draw = self.get_draw()
+        width, height = self.img.size
+
+        for item in items:
+            item = TextItem(**item) if isinstance(item, dict) else TextItem(*item)
+            font = self.arial_font if item.font is None else item.font
+
+            mask, (left, top) = _render_text(item.text, font, item.anchor)
+
+            if item.position is None:
+                x, y = (width - mask.width) // 2, (height - mask.height) // 2
+            else:
+                x, y = int(item.position[0]) + left, int(item.position[1]) + top
+
+            if draw.fontmode == "L":
+                draw.bitmap((x, y), mask, fill=item.color)
+            else:
+                # 1, P, I and F images get aliased text, which the antialiased mask can't give
+                draw.text((x - left, y - top), item.text, fill=item.color, font=font, anchor=item.anchor)
+
+        return self
+
+    def resize(self, new_width: int = None, new_height: int = None, resample=None):
         """
             Resizes the image to new dimensions. If only `new_width` is defined, `new_height` can be calculated to keep aspect ratio and vice versa. If both are defined at the same time, then image will be resized to those dimensions.
+            When shrinking an image opened from a file with reduce_on_load, a jpeg that isn't decoded yet (resize is the first operation,
+            or the first one run in lazy mode) is decoded at 1/2, 1/4 or 1/8 of its size directly by the decoder (keeping at least twice
+            the new size), and the image is reduced by a whole factor before the final resampling (keeping at least three times the new size).
+            PIL images and arrays passed to PilPlus are resampled directly.
 
             @param self:
             @param new_width: int
                 If only new width is defined, new_height can be calculated to keep aspect ratio. Both can also be defined at the same time to not keep the aspect ratio.
             @param new_height: int
                 If only new_height is defined, new_width can be calculated to keep aspect ratio. Both can also be defined at the same time to not keep the aspect ratio.
+            @param resample: int
+                PIL resampling filter, e.g. Image.LANCZOS or Image.BICUBIC. Default is the `resample` attribute (Image.LANCZOS)
             
             @return: None
         """
 
         if new_height == None and new_width == None:
             raise ValueError("New height and New width can not be none at the same time.")
-        
-        if new_height == None and new_width != None:
-            new_height = new_width * self.get_height() // self.get_width() 
-        
-        if new_width == None and new_height != None:
-            new_width = new_height * self.get_width() // self.get_height()
 
-        self.img = self.img.resize((new_width, new_height), Image.ANTIALIAS)
+        if self._defer("resize", new_width=new_width, new_height=new_height, resample=resample):
+            return self
 
+        self.img = self._resample(self._resize_dimensions(self.get_size(), new_width, new_height), resample)
 
-    def rotate(self, degrees: int):
+        return self
+
+    def thumbnail(self, new_width: int = None, new_height: int = None, sharpen: bool = True, format="JPEG", quality=None, subsampling=None,
+                  resample=None, output=None):
         """
-            Rotates the image 
+            Resize, sharpen and return_base64 in one call, e.g. for generating thumbnails. Without native array mode this is
+            exactly the three calls.
+            In native array mode, a large gray or rgb array is first halved by opencv (down to three times the new size at least)
+            instead of being turned into a full size PIL image, which is several times faster than the three calls, so the pixels
+            may differ by a few levels from resize.
+            Like the three calls, this resizes (and sharpens) the image itself.
 
             @param self:
-            @param degrees: int
-                degrees of rotation. Can be positive or negative.
-
-            @return: None
-                changes rotation internally
+            @param new_width: int
+            @param new_height: int
+                see resize
+            @param sharpen: bool
+                sharpen the resized image, like sharpen
+            @param format: str
+            @param quality: int
+            @param subsampling: int or str
+            @param output: file-like object or callable
+                see return_base64
+            @param resample: int
+                see resize
+            @return: bytes or int
+                base64 data of the thumbnail, or the number of base64 bytes written to `output` (see return_base64)
         """
-        self.img = self.img.rotate(degrees)
+        if new_height is None and new_width is None:
+            raise ValueError("New height and New width can not be none at the same time.")
 
-    def sharpen(self):
-        """
-            Sharpens the image
+        if not self.native_array:
+            # opencv sharpens a copy of PIL's pixels, and PIL's own 3x3 kernel filter is slower, so nothing to save here
+            self.resize(new_width, new_height, resample)
 
-            @param self:
-            @return: None
-        """
-        
+            if sharpen:
+                self.sharpen()
+
+            return self.return_base64(format, quality, subsampling, output=output)
+
+        img = self._resample(self._resize_dimensions(self.get_size(), new_width, new_height), resample, reduce_array=True)
+
+        if sharpen:
+            array = self._sharpen_array(np.asarray(img))
+
+            self._set_array(array)
+            # the image the encoder gets below, derived from the array
+            self._img = Image.fromarray(array)
+        else:
+            self.img = img
+
+        return self.return_base64(format, quality, subsampling, output=output)
+
+    def _resample(self, size: tuple, resample=None, reduce_array: bool = False) -> Image:
+        """
+            Internal function resampling the image to `size` for resize and thumbnail. The image itself isn't replaced
+
+            @param self:
+            @param size: tuple(width, height)
+            @param resample: int
+                PIL resampling filter, default is the `resample` attribute
+            @param reduce_array: bool
+                in native array mode, reduce the array with opencv first (see thumbnail)
+            @return: PIL.Image
+        """
+        if resample is None:
+            resample = self.resample
+
+        new_width, new_height = size
+        width, height = self.get_size()
+        shrinking = new_width * new_height < width * height
+
+        # gray and rgb only, PIL resamples colors premultiplied by alpha so that transparent pixels don't bleed into the others
+        if reduce_array and self._img is None and self._array is not None and (self._array.ndim == 2 or self._array.shape[2] == 3) \
+                and width >= new_width * 6 and height >= new_height * 6:
+            array = self._array
+
+            # halving with area interpolation averages 2x2 blocks, opencv's fastest case (an odd last row or column is dropped)
+            while array.shape[1] >= new_width * 6 and array.shape[0] >= new_height * 6:
+                array = array[:array.shape[0] // 2 * 2, :array.shape[1] // 2 * 2]
+                array = cv2.resize(array, (array.shape[1] // 2, array.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
+            return Image.fromarray(array).resize(size, resample, reducing_gap=3.0)
+
+        img = self.img
+        reducing_gap = None
+
+        if self.reduce_on_load and shrinking and self._opened:
+            reducing_gap = 3.0
+
+            # only does something for a jpeg that isn't decoded yet. DCT scaling keeps more detail than reduce,
+            # so it may go down to twice the new size
+            img.draft(None, (new_width * 2, new_height * 2))
+
+        return img.resize(size, resample, reducing_gap=reducing_gap)
+
+    def _resize_dimensions(self, size: tuple, new_width: int = None, new_height: int = None) -> tuple:
+        """
+            Internal function for calculating the dimensions resize will use for an image of `size`
+
+            @param size: tuple(width, height)
+            @param new_width: int
+            @param new_height: int
+            @return: tuple(width, height)
+        """
+        width, height = size
+
+        if new_height == None and new_width != None:
+            new_height = new_width * height // width 
+        
+        if new_width == None and new_height != None:
+            new_width = new_height * width // height
+
+        return new_width, new_height
+
+
+    def rotate(self, degrees: int):
+        """
+            Rotates the image 
+
+            @param self:
+            @param degrees: int
+                degrees of rotation. Can be positive or negative.
+
+            @return: PilPlus
+                current PilPlus object, rotated internally
+        """
+
+        if self._defer("rotate", degrees):
+            return self
+
+        self.img = self.img.rotate(degrees)
+
+        return self
+
+    def sharpen(self):
+        """
+            Sharpens the image
+
+            @param self:
+            @return: PilPlus
+                current PilPlus object
+        """
+
+        if self._defer("sharpen"):
+            return self
+
+        self._set_array(self._sharpen_array(self._get_array()))
+
+        return self
+
+    def _sharpen_array(self, array: np.ndarray) -> np.ndarray:
+        """
+            Internal function sharpening an array (see sharpen) into a new array
+
+            @param self:
+            @param array: np.ndarray
+            @return: np.ndarray
+        """
         sharpen_filter = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        sharped_img = cv2.filter2D(np.array(self.img), -1, sharpen_filter)
 
-        self.setImage(sharped_img)
+        return cv2.filter2D(array, -1, sharpen_filter)
 
     def save_brightness_scale(self, file_name: str):
         """
@@ -256,53 +1134,61 @@ class PilPlus():
             File name of output image
         @return: None 
         """
-        img = np.array(self.img)
-
-        for row in range(self.get_height()):
-            for col in range(self.get_width()):
-                bg = self.img.getpixel((col, row))
-
-                luminosity = self.calculate_luminosity(bg)
-                
-                img[row][col] = (luminosity, luminosity, luminosity)
+        img = np.array(self._get_array())
 
+        # truncating assignment into the uint8 buffer, same as the per-pixel version did
+        img[..., :3] = self._calculate_luminosity_array(img)[..., np.newaxis]
         
         self.save(file_name, img)
 
-    def remove_background(self):
+    def remove_background(self, backend: 'BackgroundRemover' = None):
         """
             removes background from the image
 
             @param self:
+            @param backend: BackgroundRemover
+                Default is the process wide backend (see get_background_remover), which keeps its model loaded between calls
             @return: None
         """
 
-        if not os.path.exists("tmp"):
-            os.mkdir("tmp")
-        
-        self.save("tmp/_____temp_____.png", replace_file=True)
-        
-        subprocess.call('backgroundremover -i "tmp/_____temp_____.png" -a -ae 15 -o "tmp/_____temp_____.png.bgremoved.png"')
+        if backend is None:
+            backend = get_background_remover()
 
-        self.setImage('tmp/_____temp_____.png.bgremoved.png')
+        self._set_array(backend.remove([self._get_rgb_array()])[0])
 
-    def fill(self, color) -> None:
+    def _get_rgb_array(self) -> np.ndarray:
+        """
+            Internal function for reading the image as an rgb numpy array
+
+            @param self:
+            @return: np.ndarray
+        """
+        if self._get_mode() == "RGB":
+            return self._get_array()
+
+        return np.asarray(self.img.convert("RGB"))
+
+    def fill(self, color) -> 'PilPlus':
         """
             Fill whole image with a particular color
 
             @param self:
             @param color: tuple or list
-            @return: None
+            @return: PilPlus
+                current PilPlus object
         """
+
+        if self._defer("fill", color):
+            return self
         
-        img = np.array(self.img)
+        img = self._writable_array()
         color = tuple(color)
 
-        for row in range(self.get_height()):
-            for col in range(self.get_width()):
-                img[row][col] = color
+        img[...] = color
 
-        self.setImage(img)
+        self._set_array(img)
+
+        return self
 
     def get_canny_edges(self):
         """
@@ -312,10 +1198,10 @@ class PilPlus():
             @return: PilPlus
         """
         
-        return PilPlus(cv2.Canny(np.asarray(self.img),100,200))
+        return PilPlus(cv2.Canny(self._get_array(),100,200), native_array=self.native_array)
 
     
-    def replace_color(self, color: tuple, replacement_color: tuple) -> None:
+    def replace_color(self, color: tuple, replacement_color: tuple) -> 'PilPlus':
         """
             @param self:
             @param color: tuple
@@ -327,134 +1213,377 @@ class PilPlus():
                 PilPlus object with changes made (image will also be changed internally inside the class) 
         """
 
-        img = np.array(self.img)
+        if self._defer("replace_color", color, replacement_color):
+            return self
 
-        for row in range(self.get_height()):
-            for col in range(self.get_width()):
-                if np.array_equal(img[row][col], color):
-                    img[row][col] = replacement_color
-            
-        self.setImage(img)
+        img = self._writable_array()
+
+        matches = self._color_mask(img, color)
+        if matches is not None:
+            img[matches] = replacement_color
+
+        self._set_array(img)
+
+        return self
+
+    def replace_colors(self, colors: dict, tolerance: float = 0, metric: str = "channel"):
+        """
+            Replaces many colors in a single pass over the image. Replacements are not chained, i.e. {A: B, B: C} turns A into B and B into C.
+
+            @param self:
+            @param colors: dict
+                mapping of rgb(a) color to be replaced -> new color
+            @param tolerance: int or float
+                how far a pixel may be from a color to still be replaced. Default 0 means exact matches only
+            @param metric: str
+                "channel" compares the largest per channel difference with the tolerance, "euclidean" compares the euclidean distance. 
+                If a pixel is within tolerance of more than one color, the closest one is used.
+
+            @return: PilPlus
+                current PilPlus object
+        """
+
+        if metric not in ("channel", "euclidean"):
+            raise ValueError("metric should be either 'channel' or 'euclidean'")
+
+        if self._defer("replace_colors", colors, tolerance, metric):
+            return self
+
+        img = self._writable_array()
+        channels = 1 if img.ndim == 2 else img.shape[2]
+
+        # like replace_color, colors that can never match a pixel of the image are ignored
+        pairs = [(source, target) for source, target in colors.items() if np.asarray(source).shape == img.shape[2:]]
+
+        if len(pairs) > 0:
+            sources = np.array([source for source, _ in pairs], dtype=np.int64).reshape(len(pairs), channels)
+            targets = np.array([target for _, target in pairs]).reshape(len(pairs), channels).astype(img.dtype)
+
+            pixels = img.reshape(-1, channels)
+
+            if tolerance == 0:
+                matched, index = self._lookup_exact_colors(self._pack_colors(pixels), self._pack_colors(sources))
+            elif img.dtype == np.uint8 and channels <= 3 and len(pixels) * 32 >= 256 ** channels:
+                # small enough color space for a dense lookup table indexed by the packed pixel. Building it takes longer than
+                # finding the palette of a small image
+                table = self._build_near_color_table(sources, tolerance, metric)
+                index = table[self._pack_colors(pixels, bits=8)]
+                matched = index >= 0
+            else:
+                # compare only the distinct colors of the image (its palette) with the source colors
+                palette_keys, first, inverse = np.unique(self._pack_colors(pixels), return_index=True, return_inverse=True)
+                palette_matched, palette_index = self._lookup_near_colors(pixels[first].astype(np.int64), sources, tolerance, metric)
+
+                matched, index = palette_matched[inverse], palette_index[inverse]
+
+            pixels[matched] = targets[index[matched]]
+
+        self._set_array(img)
+
+        return self
+
+    def _pack_colors(self, pixels: np.ndarray, bits: int = 16) -> np.ndarray:
+        """
+            Internal function for packing each (channels,) pixel of a (n, channels) array into a single integer key
+
+            @param pixels: np.ndarray
+            @param bits: int
+                bits per channel. Default 16 is enough for 8 and 16 bit images
+            @return: np.ndarray
+                uint64 array of shape (n,)
+        """
+        keys = np.zeros(len(pixels), dtype=np.uint64)
+
+        for channel in range(pixels.shape[1]):
+            keys = (keys << np.uint64(bits)) | pixels[:, channel].astype(np.uint64)
+
+        return keys
+
+    def _lookup_exact_colors(self, keys: np.ndarray, source_keys: np.ndarray):
+        """
+            Internal function for looking up packed pixel keys in a table of packed source colors
+
+            @param keys: np.ndarray
+            @param source_keys: np.ndarray
+            @return: tuple(np.ndarray, np.ndarray)
+                boolean array of matched keys and, for each key, the index of the matching source color
+        """
+        order = np.argsort(source_keys, kind="stable")
+        sorted_keys = source_keys[order]
+
+        position = np.searchsorted(sorted_keys, keys)
+        position[position == len(sorted_keys)] = 0
+
+        return sorted_keys[position] == keys, order[position]
+
+    def _build_near_color_table(self, sources: np.ndarray, tolerance: float, metric: str) -> np.ndarray:
+        """
+            Internal function for the lookup table of every 8 bit color (packed with 8 bits per channel) to the index of the closest source color
+            within tolerance. The last tables are cached (see _near_color_table), so e.g. the tiles of a TiledImage share one
+
+            @param sources: np.ndarray
+            @param tolerance: int or float
+            @param metric: str
+            @return: np.ndarray
+                read-only int32 array of size 256 ** channels, -1 where no source color is within tolerance
+        """
+        return _near_color_table(tuple(map(tuple, sources.tolist())), tolerance, metric)
+
+    def _lookup_near_colors(self, palette: np.ndarray, sources: np.ndarray, tolerance: float, metric: str):
+        """
+            Internal function for finding the closest source color within tolerance for each color of a palette
+
+            @param palette: np.ndarray
+            @param sources: np.ndarray
+            @param tolerance: int or float
+            @param metric: str
+            @return: tuple(np.ndarray, np.ndarray)
+                boolean array of matched palette colors and, for each of them, the index of the closest source color
+        """
+        limit = tolerance if metric == "channel" else tolerance ** 2
+        best_distance = np.full(len(palette), np.inf)
+        index = np.zeros(len(palette), dtype=np.intp)
 
+        for i, source in enumerate(sources):
+            difference = np.abs(palette - source)
 
-    def copy_pixels_from(self, mask: 'PilPlus', destinationColoredPixel=(255,255,255), follow_luminosity=False):
+            if metric == "channel":
+                distance = difference.max(axis=1)
+            else:
+                distance = (difference * difference).sum(axis=1)
+
+            closer = (distance <= limit) & (distance < best_distance)
+            best_distance[closer] = distance[closer]
+            index[closer] = i
+
+        return np.isfinite(best_distance), index
+
+    def _color_mask(self, img: np.ndarray, color):
+        """
+            Internal function for finding every pixel of `img` that is exactly `color`
+
+            @param img: np.ndarray
+            @param color: tuple or int
+            @return: np.ndarray or None
+                boolean mask of shape (height, width). None if `color` can never match a pixel of `img` (e.g. rgb color on an rgba image)
+        """
+        color = np.asarray(color)
+
+        if color.shape != img.shape[2:]:
+            return None
+
+        if img.ndim == 2:
+            return img == color
+
+        # channel by channel is much cheaper than np.all over a (height, width, channels) comparison
+        matches = img[..., 0] == color[0]
+        for channel in range(1, img.shape[2]):
+            matches &= img[..., channel] == color[channel]
+
+        return matches
+
+
+    def copy_pixels_from(self, mask: 'PilPlus', destinationColoredPixel=(255,255,255), follow_luminosity=False, follow_limit=2):
+        """
+        Copies the mask's pixels into every pixel of the image that is not `destinationColoredPixel`.
+
+        @param self:
+        @param mask: PilPlus
+            image of same dimensions to copy the pixels from
+        @param destinationColoredPixel: tuple
+            pixels of this color are not copied
+        @param follow_luminosity: bool
+            if True, `destinationColoredPixel` pixels lying on a luminosity gradient of the mask (see find_luminosity_increasing_path)
+            are painted with the mask's color along the gradient, which shrinks them towards the darker side of the mask
+        @param follow_limit: int
+            Number of pixels to follow for luminosity based point filling (see fill_surrounding_points).
+
+        @return: None
+        """
         if mask.get_width() != self.get_width() and mask.get_height() != self.get_height():
             raise ValueError("input and current image dimensions should be same")
-        
-        mask_width = mask.get_width()
-        mask_height = mask.get_height()
 
-        img = np.array(self.img)
+        img = self._writable_array()
+        mask_img = mask._get_array()
 
-        
-        # restriction for only painting upto 3 points (for follow_luminosity)
-        painted = False
-        paint_limit = 2
-        paint_num = 0
+        if mask_img.ndim == 2 and img.ndim == 3:
+            # grayscale mask, same value for every channel
+            mask_img = np.repeat(mask_img[..., np.newaxis], img.shape[2], axis=2)
 
-        
-        scale = 256 / 8
-
-
-        for row in range(mask_height):
-            for col in range(mask_width):
-                mask_color = mask.get_image().getpixel((col, row))
-                if self.img.getpixel((col, row)) != destinationColoredPixel:
-                    # if it is destination pixel then copy
-                    img[row][col] = mask_color
-
-
-                    if painted == True:
-                        paint_num += 1
-                    
-                    if paint_num >= paint_limit:
-                        painted = False
-                        paint_num = 0
-
-                elif follow_luminosity:
-                    # if it's not a destination pixel,
-                    # then it means it's a white pixel and we need to shrink
-                    # black pixels depending on the mask's pixel
-
-                    if self.calculate_luminosity(mask_color) >  scale * 7:
-                        continue
-
-                    if painted == False:
-                        increasing_paths = self.find_luminosity_increasing_path((col, row), mask)
-
-                        for path in increasing_paths:
-                            if path == "left":
-                                try:
-                                    for i in range(col, col + paint_limit):
-                                        bg = mask.get_image().getpixel((i, row))
-                            
-                                        optimalFilling = self.calculateOptimalFilling(bg)
-                                        img = self.fill_surrounding_points(
-                                            row, 
-                                            i, 
-                                            _range=optimalFilling[0], 
-                                            color=optimalFilling[1], 
-                                            axis="x", 
-                                            img=img,
-                                            mask=mask)
-                                except IndexError:
-                                    pass
-                            elif path == "right":
-                                try:
-                                    for i in range(col - paint_limit, col):
-                                        bg = mask.get_image().getpixel((i, row))
-                            
-                                        optimalFilling = self.calculateOptimalFilling(bg)
-                                        img = self.fill_surrounding_points(
-                                            row, 
-                                            i, 
-                                            _range=optimalFilling[0], 
-                                            color=optimalFilling[1], 
-                                            axis="x", 
-                                            img=img,
-                                            mask=mask)
-                                except IndexError:
-                                    pass
-                            elif path == "up":
-                                try:
-                                    for i in range(row - paint_limit, row):
-                                        bg = mask.get_image().getpixel((col, i))
-                            
-                                        optimalFilling = self.calculateOptimalFilling(bg)
-                                        img = self.fill_surrounding_points(
-                                            i, 
-                                            col, 
-                                            _range=optimalFilling[0], 
-                                            color=optimalFilling[1], 
-                                            axis="y", 
-                                            img=img,
-                                            mask=mask)
-                                except IndexError:
-                                    pass
-                            elif path == "down":
-                                try:
-                                    for i in range(row, row + paint_limit):
-                                        bg = mask.get_image().getpixel((col, i))
-                            
-                                        optimalFilling = self.calculateOptimalFilling(bg)
-                                        img = self.fill_surrounding_points(
-                                            i, 
-                                            col, 
-                                            _range=optimalFilling[0], 
-                                            color=optimalFilling[1], 
-                                            axis="y", 
-                                            img=img,
-                                            mask=mask)
-                                except IndexError:
-                                    pass
-
-                        paint_num += 1
-                    
-                    if paint_num >= paint_limit:
-                        painted = True
-                        paint_num = 0
-
-        self.setImage(img)
+        if mask_img.shape != img.shape:
+            raise ValueError("input and current image should have the same dimensions and number of channels")
+
+        destination = self._color_mask(img, destinationColoredPixel)
+        if destination is None:
+            destination = np.zeros(img.shape[:2], dtype=bool)
+
+        # if it is not a destination pixel then copy
+        np.copyto(self._pixel_view(img), self._pixel_view(mask_img), where=~destination)
+
+        if follow_luminosity:
+            scale = 256 / 8
+
+            luminosity = self._calculate_luminosity_array(mask._get_array())
+
+            # only destination pixels on a not too bright part of the mask
+            candidates = destination & (luminosity <= scale * 7)
+            seeds = self._luminosity_path_seeds(luminosity, candidates, paint_limit=2)
+
+            if follow_limit <= 2:
+                # only the seeds themselves are painted, which is a plain dilation of them
+
+                # see calculateOptimalFilling, brighter points have nothing to fill
+                seeds &= luminosity <= scale * 6
+
+                self._paint_seed_blocks(img, mask_img, seeds)
+            else:
+                # the first paint of a pixel wins in the engine, so going backwards matches the later seed winning above
+                points = []
+                for row, col in reversed(list(zip(*np.nonzero(seeds)))):
+                    optimalFilling = self.calculateOptimalFilling(mask_img[row, col])
+                    points.append((row, col, optimalFilling[0], optimalFilling[1], 0))
+
+                self._follow_luminosity_fill(img, mask_img, luminosity, points, follow_limit)
+
+        self._set_array(img)
+
+    def _pixel_view(self, img: np.ndarray) -> np.ndarray:
+        """
+            Internal function for viewing a contiguous (height, width, channels) array as a (height, width) array with one item per pixel,
+            so that masked copies move whole pixels at once
+
+            @param img: np.ndarray
+            @return: np.ndarray
+                view of `img`, writing to it changes `img`
+        """
+        if img.ndim == 2:
+            return img
+
+        return np.ascontiguousarray(img).view(np.dtype((np.void, img.shape[2] * img.itemsize)))[..., 0]
+
+    def _luminosity_path_seeds(self, luminosity: np.ndarray, candidates: np.ndarray, paint_limit: int = 2) -> np.ndarray:
+        """
+            Internal function, vectorized version of find_luminosity_increasing_path over every candidate pixel at once.
+            The points up to `paint_limit` pixels along each found direction become seeds for painting.
+
+            @param luminosity: np.ndarray
+                (height, width) luminosity of the mask
+            @param candidates: np.ndarray
+                boolean (height, width) array of the pixels to test
+            @param paint_limit: int
+            @return: np.ndarray
+                boolean (height, width) array of the seed points
+        """
+        height, width = luminosity.shape
+
+        # 4 pixels starting at x (or y) in decreasing order
+        left = self._monotonic_run(luminosity, axis=1, increasing=False)
+        down = self._monotonic_run(luminosity, axis=0, increasing=False)
+
+        # 4 pixels ending at x - 1 (or y - 1) in increasing order
+        right = self._shift(self._monotonic_run(luminosity, axis=1, increasing=True), 0, 4)
+        up = self._shift(self._monotonic_run(luminosity, axis=0, increasing=True), 4, 0)
+
+        seeds = np.zeros((height, width), dtype=bool)
+
+        for direction, offsets in ((left, [(0, i) for i in range(paint_limit)]),
+                                   (right, [(0, -i) for i in range(1, paint_limit + 1)]),
+                                   (up, [(-i, 0) for i in range(1, paint_limit + 1)]),
+                                   (down, [(i, 0) for i in range(paint_limit)])):
+            found = candidates & direction
+
+            for dy, dx in offsets:
+                seeds |= self._shift(found, dy, dx)
+
+        return seeds
+
+    def _monotonic_run(self, luminosity: np.ndarray, axis: int, increasing: bool) -> np.ndarray:
+        """
+            Internal function, vectorized version of is_luminosity_increasing / is_luminosity_decreasing.
+            For each index i along `axis`, whether the 4 values starting at i are in non decreasing (or non increasing) order and not all equal.
+            Entries without 4 values are False.
+
+            @param luminosity: np.ndarray
+            @param axis: int
+            @param increasing: bool
+            @return: np.ndarray
+                boolean array of the same shape as `luminosity`
+        """
+        values = np.moveaxis(luminosity, axis, 0)
+
+        length = values.shape[0]
+        result = np.zeros(values.shape, dtype=bool)
+
+        if length >= 4:
+            # shifted array comparisons instead of walking the 4 values of each pixel
+            if increasing:
+                step = values[1:] >= values[:-1]
+                changed = values[:length - 3] < values[3:]
+            else:
+                step = values[1:] <= values[:-1]
+                changed = values[:length - 3] > values[3:]
+
+            result[:length - 3] = step[:length - 3] & step[1:length - 2] & step[2:] & changed
+
+        return np.moveaxis(result, 0, axis)
+
+    def _shift(self, arr: np.ndarray, dy: int, dx: int) -> np.ndarray:
+        """
+            Internal function for moving the values of a 2d boolean array by (dy, dx). Values shifted out are dropped, new entries are False.
+
+            @param arr: np.ndarray
+            @param dy: int
+            @param dx: int
+            @return: np.ndarray
+        """
+        height, width = arr.shape
+        result = np.zeros_like(arr)
+
+        if abs(dy) >= height or abs(dx) >= width:
+            return result
+
+        result[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+            arr[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+
+        return result
+
+    def _paint_seed_blocks(self, img: np.ndarray, mask_img: np.ndarray, seeds: np.ndarray) -> None:
+        """
+            Internal function. Paints the 2x2 block ending at every seed point (see fill_surrounding_points with a range of (1, 1))
+            with the mask's color at that seed, i.e. a color carrying dilation of the seeds. Where blocks overlap, the later seed in
+            row major order wins.
+
+            @param img: np.ndarray
+                image to paint in place
+            @param mask_img: np.ndarray
+            @param seeds: np.ndarray
+                boolean (height, width) array
+            @return: None
+        """
+        offsets = ((0, 0), (0, 1), (1, 0), (1, 1))
+
+        pixels, colors = self._pixel_view(img), self._pixel_view(mask_img)
+
+        if np.count_nonzero(seeds) * 4 < seeds.size:
+            # few seeds, only touch the covered pixels
+            width = seeds.shape[1]
+            positions = np.flatnonzero(seeds)
+            seed_colors = colors.ravel()[positions]
+
+            for dy, dx in offsets:
+                inside = np.ones(len(positions), dtype=bool)
+                if dy:
+                    inside &= positions >= width
+                if dx:
+                    inside &= positions % width >= 1
+
+                pixels.ravel()[positions[inside] - (dy * width + dx)] = seed_colors[inside]
+
+            return
+
+        for dy, dx in offsets:
+            # pixel p is covered by the seed at p + (dy, dx)
+            np.copyto(pixels[:pixels.shape[0] - dy, :pixels.shape[1] - dx], colors[dy:, dx:], where=seeds[dy:, dx:])
 
     def calculate_luminosity(self, pixel):
         """
@@ -468,6 +1597,24 @@ class PilPlus():
         
         return 0.2126 * pixel[0] + 0.7152 * pixel[1] + 0.0722 * pixel[2] # per ITU-R BT.709
 
+    def _calculate_luminosity_array(self, img: np.ndarray) -> np.ndarray:
+        """
+            Internal function, vectorized version of calculate_luminosity over a whole (height, width, channels) array
+
+            @param img: np.ndarray
+            @return: np.ndarray
+                float64 array of shape (height, width)
+        """
+        if img.ndim == 2:
+            # grayscale, the coefficients add up to 1
+            return img.astype(np.float64)
+
+        # uint8 * float64 scalar is computed in float64, no need to convert the whole image first
+        red, green, blue = 0.2126 * img[..., 0], 0.7152 * img[..., 1], 0.0722 * img[..., 2]
+
+        # same operation order as calculate_luminosity so results are bit-identical
+        return red + green + blue
+
     def calculateOptimalFilling(self, bg):
         luma = self.calculate_luminosity(bg)
         brightness_scale = 256 / 8
@@ -628,116 +1775,122 @@ class PilPlus():
             how many pixels is the surrounding?
         @param color: tuple
             color to be filled
-        @param img: PilPlus
+        @param img: np.ndarray
             Default is the image object that this class holds
         @param mask: PilPlus
             An image to be used as a mask from which
         @param follow_limit: int
             Number of pixels to follow for luminosity based point filling.
 
-        @return: PilPlus
-            A PilPlus object containing the image with specified changes.
+        @return: np.ndarray
+            the image with specified changes (`img` is changed in place).
         """
-        if img is None:
-            img = self.img
+        if mask is None:
+            return img
 
-        # print(followMask)
+        update_image = img is None
+        if update_image:
+            img = self._writable_array()
 
-        if mask == None:
-            return img
-        
-        if _follow_num >= follow_limit:
+        mask_img = mask._get_array()
+        height, width = mask_img.shape[:2]
+
+        if not (0 <= y < height and 0 <= x < width):
             return img
 
-        col = x
-        row = y
+        # only the window the fill can reach is read: one pixel per followed step, plus the painted block
+        # and the 4 pixels read on each side for the luminosity paths
+        margin = max(follow_limit, 0) + max(4, *_range) + 1
+        rows = slice(max(y - margin, 0), y + margin + 1)
+        cols = slice(max(x - margin, 0), x + margin + 1)
 
-        for i in range(y - _range[0], y + _range[0]):
-            for j in range(x - _range[0], x + _range[1]):
-                try:
-                    img[i][j] = color
-                except IndexError:
-                    pass    
+        window = mask_img[rows, cols]
+        self._follow_luminosity_fill(img[rows, cols], window, self._calculate_luminosity_array(window),
+                                     [(y - rows.start, x - cols.start, _range, color, _follow_num)], follow_limit)
 
-        paths = self.find_luminosity_increasing_path((col, row), mask)
+        if update_image:
+            self._set_array(img)
 
-        limit = 1
+        return img
 
-        for path in paths:
-            if path == "left":
-                try:
-                    for i in range(col, col + limit):
-                        bg = mask.get_image().getpixel((i, row))
-            
-                        optimalFilling = self.calculateOptimalFilling(bg)
-                        img = self.fill_surrounding_points(
-                            row, 
-                            i, 
-                            _range=optimalFilling[0], 
-                            color=optimalFilling[1], 
-                            axis="x", 
-                            img=img,
-                            mask=mask,
-                            follow_limit=follow_limit-1,
-                            follow_num=_follow_num+1)
-                except IndexError:
-                    pass
-            elif path == "right":
-                try:
-                    for i in range(col - limit, col):
-                        bg = mask.get_image().getpixel((i, row))
-            
-                        optimalFilling = self.calculateOptimalFilling(bg)
-                        img = self.fill_surrounding_points(
-                            row, 
-                            i, 
-                            _range=optimalFilling[0], 
-                            color=optimalFilling[1], 
-                            axis="x", 
-                            img=img,
-                            mask=mask,
-                            follow_limit=follow_limit-1,
-                            follow_num=_follow_num+1)
-                except IndexError:
-                    pass
-            elif path == "up":
-                try:
-                    for i in range(row - limit, row):
-                        bg = mask.get_image().getpixel((col, i))
-            
-                        optimalFilling = self.calculateOptimalFilling(bg)
-                        img = self.fill_surrounding_points(
-                            i, 
-                            col, 
-                            _range=optimalFilling[0], 
-                            color=optimalFilling[1], 
-                            axis="y", 
-                            img=img,
-                            mask=mask,
-                            follow_limit=follow_limit-1,
-                            follow_num=_follow_num+1)
-                except IndexError:
-                    pass
-            elif path == "down":
-                try:
-                    for i in range(row, row + limit):
-                        bg = mask.get_image().getpixel((col, i))
-            
-                        optimalFilling = self.calculateOptimalFilling(bg)
-                        img = self.fill_surrounding_points(
-                            i, 
-                            col, 
-                            _range=optimalFilling[0], 
-                            color=optimalFilling[1], 
-                            axis="y", 
-                            img=img,
-                            mask=mask,
-                            follow_limit=follow_limit-1,
-                            follow_num=_follow_num+1)
-                except IndexError:
-                    pass
+    def _follow_luminosity_fill(self, img: np.ndarray, mask_img: np.ndarray, luminosity: np.ndarray, points, follow_limit=2) -> None:
+        """
+            Internal engine of fill_surrounding_points. Paints the surrounding of each point and then follows the luminosity
+            increasing paths of the mask (see find_luminosity_increasing_path), one pixel per step, using an explicit work queue.
+            Each point is visited and each pixel is painted at most once, so the first paint of a pixel wins.
+
+            @param img: np.ndarray
+                image to paint in place
+            @param mask_img: np.ndarray
+            @param luminosity: np.ndarray
+                (height, width) luminosity of the mask
+            @param points: iterable
+                (y, x, _range, color, depth) tuples to start from
+            @param follow_limit: int
+                Number of pixels to follow. As in the recursive version, a point at depth d is only painted and followed while d < follow_limit - d.
+            @return: None
+        """
+        height, width = luminosity.shape
 
-        return img
+        visited = np.zeros((height, width), dtype=bool)
+        painted = np.zeros((height, width), dtype=bool)
+
+        # one pixel step for each direction
+        steps = {"left": (0, 0), "right": (0, -1), "up": (-1, 0), "down": (0, 0)}
+
+        queue = deque(points)
+
+        while queue:
+            y, x, _range, color, depth = queue.popleft()
+
+            if depth >= follow_limit - depth or not (0 <= y < height and 0 <= x < width) or visited[y, x]:
+                continue
+
+            visited[y, x] = True
+
+            rows = slice(max(y - _range[0], 0), max(y + _range[0], 0))
+            cols = slice(max(x - _range[0], 0), max(x + _range[1], 0))
+
+            unpainted = ~painted[rows, cols]
+            if unpainted.any():
+                block = img[rows, cols]
+                block[unpainted] = color
+                painted[rows, cols] = True
+
+            for path in self._luminosity_paths_at(luminosity, y, x):
+                dy, dx = steps[path]
+                row, col = y + dy, x + dx
+
+                if 0 <= row < height and 0 <= col < width and not visited[row, col]:
+                    optimalFilling = self.calculateOptimalFilling(mask_img[row, col])
+                    queue.append((row, col, optimalFilling[0], optimalFilling[1], depth + 1))
+
+    def _luminosity_paths_at(self, luminosity: np.ndarray, y: int, x: int) -> list:
+        """
+            Internal function, same as find_luminosity_increasing_path but reading a precomputed luminosity array
+
+            @param luminosity: np.ndarray
+                (height, width) luminosity of the mask
+            @param y: int
+            @param x: int
+            @return: list
+                list of directions in which luminosity is increasing. Example ["left", "right", "up", "down"]
+        """
+        height, width = luminosity.shape
+
+        left = list(luminosity[y, x:x + 4]) if x + 4 <= width else []
+        right = list(luminosity[y, x - 4:x]) if x >= 4 else []
+        up = list(luminosity[y - 4:y, x]) if y >= 4 else []
+        down = list(luminosity[y:y + 4, x]) if y + 4 <= height else []
+
+        result = []
+
+        if self.is_luminosity_increasing(left): result.append("left")
+        if self.is_luminosity_decreasing(right): result.append("right")
+        if self.is_luminosity_decreasing(up): result.append("up")
+        if self.is_luminosity_increasing(down): result.append("down")
+
+        return result
                 
     def get_image(self) -> Image:
         """
@@ -748,17 +1901,28 @@ class PilPlus():
         
         return self.img
 
-    def get_numpy_array(self) -> np.ndarray: 
+    def get_numpy_array(self, copy=True) -> np.ndarray: 
         """
  
             @param self:
+            @param copy: bool
+                if False, return a read-only array instead of a copy. In native array mode it is a view of the image's buffer (no copy at all)
             @return: np.ndarray 
                 numpy array of the image
         """
-        return np.array(self.img)
+        if copy:
+            return self._get_array().copy()
 
-    def show(self) -> None:
-        """
+        view = self._get_array().view()
+        view.flags.writeable = False
+
+        # the buffer is now visible outside, later operations must not change it in place
+        self._array_owned = False
+
+        return view
+
+    def show(self) -> None:
+        """
             displays the image
             
             @param self:
@@ -772,59 +1936,2279 @@ class PilPlus():
         self.bgr_to_rgb()
         
 
-    def save(self, path="outputs/output.png", img=None, replace_file=False, add_top_border=False) -> None:
+    def save(self, path="outputs/output.png", img=None, replace_file=False, add_top_border=False, quality=None, compress_level=None,
+             progressive=False, optimize=False, preview=False) -> None:
         """
             saves the image
 
             @param self:
             @param path: str
-                path of output file including the its name. 
-            @param img: PIL.Image 
+                path of output file including the its name. The format is picked from the extension.
+            @param img: PIL.Image or np.ndarray
                 if None, it will save the image that this particular class holds. Passing another image to it will save that image
             @param replace_file: bool 
                 Replace the file if filename already exists?
             @param add_top_border: bool 
                 if True, output file will have 8px white border on top of the image.   
-            @return: None
+            @param quality: int
+                jpeg/webp quality (1-100). Default is the encoder's default
+            @param compress_level: int
+                png compression level (0-9). Default is the encoder's default
+            @param progressive: bool
+                save a progressive jpeg
+            @param optimize: bool
+                let the jpeg/png encoder spend more time on a smaller file
+            @param preview: bool
+                if True, render the image with matplotlib (bilinear interpolation at 600 dpi) instead of saving its pixels as they are
+            @return: str
+                path of the saved file (different from `path` if the file existed and replace_file is False)
+        """
+
+        return self._save(None, path, img, replace_file, add_top_border, quality, compress_level, progressive, optimize, preview)
+
+    def _save(self, cancelled: threading.Event, path="outputs/output.png", img=None, replace_file=False, add_top_border=False, quality=None,
+              compress_level=None, progressive=False, optimize=False, preview=False) -> str:
+        """
+            Internal function doing the work of save (see save for the other parameters)
+
+            @param self:
+            @param cancelled: threading.Event
+                if set once the image is encoded, the file is not written (see _write_atomically)
+            @return: str
+                path of the saved file, None if cancelled
         """
 
         if img is None:
             img = self.img
+        elif _is_numpy(img):
+            img = Image.fromarray(img)
 
-        if path == "outputs/output.png" and not os.path.exists(path):
-            os.mkdir("outputs")
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory)
 
         if not replace_file:
+            root, extension = os.path.splitext(path)
+
             count = 0
             while os.path.exists(path):
-                path = path.split(".")[0].split("_")[0] + "_" + str(count + 1) +  ".png"
                 count += 1
+                path = root + "_" + str(count) + extension
 
         if add_top_border:
-            new_size = (self.get_width(), self.get_height() + 8)
+            new_size = (img.size[0], img.size[1] + 8)
 
             new_im = Image.new("RGB", new_size, (255,255,255))
-            box = tuple((n - o) for n, o in zip(new_size, self.get_size()))
+            box = tuple((n - o) for n, o in zip(new_size, img.size))
             new_im.paste(img, box)
 
             img = new_im
 
-        plt.imshow(img, interpolation="bilinear")
-        plt.axis("off")
-        plt.savefig(path, bbox_inches='tight', pad_inches=0, dpi=600)
+        if preview:
+            def write(temporary):
+                figure = plt.figure()
+
+                try:
+                    plt.imshow(img, interpolation="bilinear")
+                    plt.axis("off")
+                    plt.savefig(temporary, format=os.path.splitext(path)[1][1:] or None, bbox_inches='tight', pad_inches=0, dpi=600)
+                finally:
+                    # figures are kept by pyplot until closed
+                    plt.close(figure)
+
+            return self._write_atomically(path, write, cancelled)
+
+        image_format = self._get_format(path)
+        img = self._convert_for_format(img, image_format)
+        options = self._get_encoder_options(image_format, quality, compress_level, progressive, optimize)
+
+        return self._write_atomically(path, lambda temporary: img.save(temporary, format=image_format, **options), cancelled)
+
+    def _write_atomically(self, path: str, write, cancelled: threading.Event = None) -> str:
+        """
+            Internal function writing a file to a temporary file next to it, which only replaces `path` once complete.
+            An interrupted or cancelled save never leaves a half-written file behind
+
+            @param self:
+            @param path: str
+            @param write: callable
+                writes the file to the path it is called with
+            @param cancelled: threading.Event
+                if set once the file is written, the temporary file is removed instead
+            @return: str
+                `path`, None if cancelled
+        """
+        directory, name = os.path.split(path)
+        temporary = os.path.join(directory, "." + name + "." + os.urandom(4).hex() + ".tmp")
+
+        try:
+            write(temporary)
+
+            if cancelled is not None and cancelled.is_set():
+                os.remove(temporary)
+                return None
+
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+        return path
+
+    def _convert_for_format(self, img: Image, image_format: str) -> Image:
+        """
+            Internal function for converting an image to a mode `image_format` can store (e.g. jpeg has no alpha channel)
+
+            @param img: PIL.Image
+            @param image_format: str
+            @return: PIL.Image
+        """
+        if image_format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+            return img.convert("RGB")
+
+        return img
+
+    def _get_format(self, path: str) -> str:
+        """
+            Internal function for picking the PIL format from the extension of a path
+
+            @param path: str
+            @return: str
+                PIL format name, e.g. "PNG" or "JPEG"
+        """
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension not in Image.registered_extensions():
+            Image.init()
+
+        try:
+            return Image.registered_extensions()[extension]
+        except KeyError:
+            raise ValueError("unknown image extension: '" + extension + "'")
+
+    def _get_encoder_options(self, image_format: str, quality=None, compress_level=None, progressive=False, optimize=False, subsampling=None) -> dict:
+        """
+            Internal function for translating the encoding options of save into PIL's options for `image_format`
+
+            @param image_format: str
+            @return: dict
+                keyword arguments for PIL.Image.save
+        """
+        options = {}
+
+        if image_format == "JPEG":
+            if quality is not None:
+                options["quality"] = quality
 
+            if subsampling is not None:
+                options["subsampling"] = subsampling
 
-    def return_base64(self):
+            options["progressive"] = progressive
+            options["optimize"] = optimize
+        elif image_format == "PNG":
+            if compress_level is not None:
+                options["compress_level"] = compress_level
+
+            options["optimize"] = optimize
+        elif image_format == "WEBP":
+            if quality is not None:
+                options["quality"] = quality
+
+        return options
+
+    def return_base64(self, format="JPEG", quality=None, subsampling=None, buffer: BytesIO = None, output=None, chunk_size=3 * 65536):
         """
             Returns the base64 data of the image
 
             @param self:
-            @return: -> bytes 
-                base64 data of the image
+            @param format: str
+                image format, e.g. "JPEG", "PNG" or "WEBP"
+            @param quality: int
+                jpeg/webp quality (1-100). Default is the encoder's default
+            @param subsampling: int or str
+                jpeg chroma subsampling, e.g. 0 or "4:4:4", 2 or "4:2:0"
+            @param buffer: BytesIO
+                buffer to encode into. Default is a buffer reused by every call in the current thread (up to ENCODE_BUFFER_LIMIT bytes).
+                The buffer keeps its size between calls, the encoded image is at its beginning.
+            @param output: file-like object or callable
+                if given, the base64 data is written to it (its `write` method or the callable itself) in chunks instead of being returned, 
+                so there is never a full copy of the base64 data in memory
+            @param chunk_size: int
+                number of encoded image bytes per chunk written to `output` (rounded down to a multiple of 3)
+            @return: -> bytes or int
+                base64 data of the image, or the number of base64 bytes written to `output`
         """
 
-        buffered = BytesIO()
-        self.img.save(buffered, format="JPEG")
-        return base64.b64encode(buffered.getvalue())
+        if buffer is None:
+            buffer = self._get_encode_buffer()
 
-    
+        size = self._encode_into(buffer, format, quality, subsampling)
+
+        try:
+            with buffer.getbuffer() as view:
+                encoded = view[:size]
+
+                try:
+                    if output is None:
+                        return base64.b64encode(encoded)
+
+                    write = output.write if hasattr(output, "write") else output
+
+                    # base64 of a multiple of 3 bytes has no padding, so the chunks can be joined
+                    chunk_size = max(chunk_size - chunk_size % 3, 3)
+                    written = 0
+
+                    for start in range(0, size, chunk_size):
+                        chunk = base64.b64encode(encoded[start:start + chunk_size])
+                        write(chunk)
+                        written += len(chunk)
+
+                    return written
+                finally:
+                    encoded.release()
+        finally:
+            self._release_encode_buffer(buffer)
+
+    def encode(self, format="JPEG", quality=None, subsampling=None) -> bytes:
+        """
+            Returns the image encoded in `format` (the content of the file save would write)
+
+            @param self:
+            @param format: str
+                image format, e.g. "JPEG", "PNG" or "WEBP"
+            @param quality: int
+                jpeg/webp quality (1-100). Default is the encoder's default
+            @param subsampling: int or str
+                jpeg chroma subsampling, e.g. 0 or "4:4:4", 2 or "4:2:0"
+            @return: bytes
+        """
+        buffer = self._get_encode_buffer()
+        size = self._encode_into(buffer, format, quality, subsampling)
+
+        try:
+            with buffer.getbuffer() as view:
+                return bytes(view[:size])
+        finally:
+            self._release_encode_buffer(buffer)
+
+    def _encode_into(self, buffer: BytesIO, format: str, quality=None, subsampling=None) -> int:
+        """
+            Internal function encoding the image at the beginning of `buffer`
+
+            @param self:
+            @param buffer: BytesIO
+            @return: int
+                size of the encoded image
+        """
+        image_format = format.upper()
+        if image_format == "JPG":
+            image_format = "JPEG"
+
+        buffer.seek(0)
+
+        img = self._convert_for_format(self.img, image_format)
+        img.save(buffer, format=image_format, **self._get_encoder_options(image_format, quality, subsampling=subsampling))
+
+        return buffer.tell()
+
+    def _get_encode_buffer(self) -> BytesIO:
+        """
+            Internal function for getting the encoding buffer of the current thread
+
+            @param self:
+            @return: BytesIO
+        """
+        buffer = getattr(_encode_buffers, "buffer", None)
+
+        if buffer is None:
+            buffer = _encode_buffers.buffer = BytesIO()
+
+        return buffer
+
+    def _release_encode_buffer(self, buffer: BytesIO) -> None:
+        """
+            Internal function called when an encoding is done with `buffer`. The buffer of the current thread is dropped if
+            it grew above ENCODE_BUFFER_LIMIT, so a thread doesn't keep the memory of the largest image it ever encoded
+
+            @param self:
+            @param buffer: BytesIO
+            @return: None
+        """
+        if buffer is getattr(_encode_buffers, "buffer", None) and buffer.getbuffer().nbytes > ENCODE_BUFFER_LIMIT:
+            _encode_buffers.buffer = None
+
+    @classmethod
+    async def aopen(cls, img, size=None, **kwargs) -> 'PilPlus':
+        """
+            Awaitable version of PilPlus(img, size, ...): opens and decodes the image in the async executor (see set_async_executor)
+
+            @param img: str, np.ndarray, PIL.Image or PilPlus
+            @param size: tuple
+            @return: PilPlus
+        """
+        return await _run_async(cls, img, size, **kwargs)
+
+    async def arun(self, operations):
+        """
+            Runs operations in the async executor (see set_async_executor). The image must not be used elsewhere until it's done
+
+            @param self:
+            @param operations: callable or list
+                function called with this image, or a list of operations like ["sharpen", ("resize", (100,), {})] (see map_threads)
+            @return: PilPlus
+                current PilPlus object (or the new image given by an operation like get_canny_edges),
+                or the return value of `operations` if it is a function
+        """
+        def run():
+            if callable(operations):
+                return operations(self)
+
+            return _apply_operations(self, operations).run_pending()
+
+        return await _run_async(run)
+
+    async def aencode(self, format="JPEG", quality=None, subsampling=None, **kwargs):
+        """
+            Awaitable version of return_base64, encodes in the async executor (see set_async_executor)
+
+            @return: bytes or int
+                base64 data of the image, or the number of base64 bytes written to `output` (see return_base64)
+        """
+        return await _run_async(self.return_base64, format, quality, subsampling, **kwargs)
+
+    async def asave(self, path="outputs/output.png", **kwargs) -> str:
+        """
+            Awaitable version of save, encodes and writes in the async executor (see set_async_executor).
+            If cancelled, the file is not written, not even partly: a save that already started finishes in the background
+            but its temporary file is removed instead of replacing `path`
+
+            @param self:
+            @param path: str
+            @param kwargs:
+                other arguments of save
+            @return: str
+                path of the saved file
+        """
+        cancelled = threading.Event()
+
+        try:
+            return await _run_async(self._save, cancelled, path, **kwargs)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+
+class BackgroundRemover(ABC):
+    """
+        Base class of the background removal backends used by PilPlus.remove_background. Backends implement remove
+    """
+
+    @abstractmethod
+    def remove(self, images: list) -> list:
+        """
+            Removes the background of many images at once
+
+            @param images: list
+                rgb np.ndarray images
+            @return: list
+                rgba np.ndarray images, same size as the input ones, with a transparent background
+        """
+        raise NotImplementedError
+
+
+class U2NetBackgroundRemover(BackgroundRemover):
+    """
+        Background removal with the u2net models of the backgroundremover package, with the same settings as
+        `backgroundremover -a -ae 15`. The model is loaded on first use and kept for the life of the object, and runs on the CPU.
+    """
+
+    def __init__(self, model_name="u2net", alpha_matting=True, alpha_matting_foreground_threshold=240, alpha_matting_background_threshold=10,
+                 alpha_matting_erode_structure_size=15, alpha_matting_base_size=1000, batch_size=4) -> None:
+        """
+            @param model_name: str
+                "u2net", "u2netp" or "u2net_human_seg"
+            @param alpha_matting: bool
+                refine the edges of the cutout with alpha matting (slower)
+            @param batch_size: int
+                number of images per inference of the model
+        """
+        self.model_name = model_name
+        self.alpha_matting = alpha_matting
+        self.alpha_matting_foreground_threshold = alpha_matting_foreground_threshold
+        self.alpha_matting_background_threshold = alpha_matting_background_threshold
+        self.alpha_matting_erode_structure_size = alpha_matting_erode_structure_size
+        self.alpha_matting_base_size = alpha_matting_base_size
+        self.batch_size = batch_size
+
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        """
+            Internal function for loading the model once
+
+            @return: torch.nn.Module
+        """
+        with self._lock:
+            if self._model is None:
+                import torch
+                from backgroundremover.u2net import detect
+
+                self._model = detect.load_model(model_name=self.model_name).to(torch.device("cpu"))
+
+        return self._model
+
+    def remove(self, images: list) -> list:
+        from backgroundremover import bg
+
+        results = []
+
+        for start in range(0, len(images), self.batch_size):
+            batch = [Image.fromarray(image) for image in images[start:start + self.batch_size]]
+
+            for img, mask in zip(batch, self._predict(batch)):
+                if self.alpha_matting:
+                    cutout = bg.alpha_matting_cutout(img, mask, self.alpha_matting_foreground_threshold, self.alpha_matting_background_threshold,
+                                                     self.alpha_matting_erode_structure_size, self.alpha_matting_base_size)
+                else:
+                    cutout = bg.naive_cutout(img, mask)
+
+                results.append(np.asarray(cutout.convert("RGBA")))
+
+        return results
+
+    def _predict(self, images: list) -> list:
+        """
+            Internal function, batched version of backgroundremover's detect.predict
+
+            @param images: list
+                rgb PIL.Image images
+            @return: list
+                320x320 PIL.Image masks (mode L)
+        """
+        import torch
+        from backgroundremover.u2net import detect
+
+        model = self._get_model()
+
+        inputs = torch.stack([detect.preprocess(np.array(img))["image"] for img in images]).float()
+
+        with torch.no_grad():
+            predictions = model(inputs)[0][:, 0, :, :]
+
+        # normalized per image, like predict does for its single image
+        return [Image.fromarray(detect.norm_pred(prediction).numpy() * 255).convert("RGB").convert("L") for prediction in predictions]
+
+
+class StubBackgroundRemover(BackgroundRemover):
+    """
+        Deterministic background removal without a model, for tests: pixels close to the color of the top left corner become transparent
+    """
+
+    def __init__(self, tolerance=30) -> None:
+        """
+            @param tolerance: int
+                largest per channel difference from the corner color that still counts as background
+        """
+        self.tolerance = tolerance
+
+    def remove(self, images: list) -> list:
+        results = []
+
+        for image in images:
+            difference = np.abs(image.astype(np.int16) - image[0, 0].astype(np.int16)).max(axis=2)
+            alpha = np.where(difference <= self.tolerance, 0, 255).astype(np.uint8)
+
+            results.append(np.dstack([image, alpha]))
+
+        return results
+
+
+_background_remover = None
+_background_remover_lock = threading.Lock()
+
+
+def get_background_remover() -> BackgroundRemover:
+    """
+        Outputs the process wide background removal backend, by default a U2NetBackgroundRemover created on first use
+
+        @return: BackgroundRemover
+    """
+    global _background_remover
+
+    with _background_remover_lock:
+        if _background_remover is None:
+            _background_remover = U2NetBackgroundRemover()
+
+        return _background_remover
+
+
+def set_background_remover(backend: BackgroundRemover) -> None:
+    """
+        Replaces the process wide background removal backend, e.g. with StubBackgroundRemover in tests
+
+        @param backend: BackgroundRemover
+        @return: None
+    """
+    global _background_remover
+
+    with _background_remover_lock:
+        _background_remover = backend
+
+
+def remove_backgrounds(images: list, backend: BackgroundRemover = None) -> list:
+    """
+        Removes the background of many PilPlus images with a single batched call of the backend. The images are changed in place.
+
+        @param images: list
+            PilPlus images
+        @param backend: BackgroundRemover
+            Default is the process wide backend (see get_background_remover)
+        @return: list
+            the same PilPlus images
+    """
+    if backend is None:
+        backend = get_background_remover()
+
+    for img, result in zip(images, backend.remove([img._get_rgb_array() for img in images])):
+        img._set_array(result)
+
+    return images
+
+
+def apply_backgrounds(images, background):
+    """
+        Applies a background to many images with transparent backgrounds (e.g. after remove_backgrounds)
+
+        @param images: list or np.ndarray
+            PilPlus images, which are changed in place, or an N x H x W x 4 rgba array (see composite_alpha)
+        @param background: color or image
+            see apply_background. A background image is read once for all the images
+        @return: list or np.ndarray
+            the same PilPlus images, or the N x H x W x 3 rgb array
+    """
+    if _is_numpy(images):
+        return composite_alpha(images, background)
+
+    background = _get_background_array(background)
+
+    for img in images:
+        img.apply_background(background)
+
+    return images
+
+
+def composite_alpha(foreground: np.ndarray, background) -> np.ndarray:
+    """
+        Composites rgba pixels over a background with the integer blending of PIL's paste:
+        (color * alpha + background * (255 - alpha)) / 255, rounded. The array is wrapped by PIL without being copied and
+        a stack is composited in one call, as a single tall image.
+
+        @param foreground: np.ndarray
+            H x W x 4 rgba image, or N x H x W x 4 stack of images of the same size (uint8)
+        @param background: color or image
+            a PIL color (e.g. (255, 255, 255) or "white"), or an image of the same size: PIL image, PilPlus, H x W x 3 array,
+            or for a stack, an N x H x W x 3 array of a background per image
+        @return: np.ndarray
+            H x W x 3 (or N x H x W x 3) rgb uint8 array, read-only
+    """
+    if foreground.dtype != np.uint8 or foreground.ndim not in (3, 4) or foreground.shape[-1] != 4:
+        raise ValueError("foreground should be an H x W x 4 or N x H x W x 4 uint8 array")
+
+    shape = foreground.shape[:-1] + (3,)
+    foreground = np.ascontiguousarray(foreground)
+
+    image = Image.frombuffer("RGBA", (shape[-2], foreground.size // (shape[-2] * 4)), foreground, "raw", "RGBA", 0, 1)
+
+    return np.asarray(_composite_alpha_image(image, background, shape)).reshape(shape)
+
+
+def _composite_alpha_image(image: Image.Image, background, shape: tuple = None) -> Image.Image:
+    """
+        Internal function pasting an rgba PIL image over a background (see composite_alpha), with its alpha channel as the mask
+
+        @param image: PIL.Image
+        @param background: color or image
+        @param shape: tuple
+            shape of the rgb result, (N, H, W, 3) for a stack stored as one tall image. Default is the size of `image`
+        @return: PIL.Image
+    """
+    if shape is None:
+        shape = (image.height, image.width, 3)
+
+    background = _get_background_array(background)
+
+    if background.ndim == 1:
+        canvas = Image.new("RGB", image.size, tuple(background.tolist()))
+    else:
+        if background.shape[-3:-1] != shape[-3:-1] or background.ndim > len(shape):
+            raise ValueError("background should have the same size as the image")
+
+        # one background for every image of a stack is repeated
+        background = np.broadcast_to(background, shape)
+        canvas = Image.fromarray(np.ascontiguousarray(background).reshape(-1, shape[-2], 3))
+
+    canvas.paste(image, (0, 0), image)
+
+    return canvas
+
+
+def _get_background_array(background) -> np.ndarray:
+    """
+        Internal function for turning a background color or image (see composite_alpha) into an rgb uint8 array:
+        a single color, or an H x W x 3 (or N x H x W x 3) image
+
+        @param background: color or image
+        @return: np.ndarray
+    """
+    if isinstance(background, PilPlus):
+        return background._get_rgb_array()
+
+    if isinstance(background, Image.Image):
+        return np.asarray(background if background.mode == "RGB" else background.convert("RGB"))
+
+    if _is_numpy(background) and background.ndim > 1:
+        if background.dtype != np.uint8 or background.shape[-1] not in (3, 4):
+            raise ValueError("background image should be an rgb(a) uint8 array")
+
+        return background[..., :3]
+
+    if _is_numpy(background):
+        return background.astype(np.uint8)
+
+    if background is None:
+        background = (0, 0, 0)
+
+    # exactly how PIL reads the color for Image.new: tuples, strings like "white" or "#ffffff", integers...
+    return np.array(Image.new("RGB", (1, 1), background).getpixel((0, 0)), dtype=np.uint8)
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+BatchResult = namedtuple("BatchResult", ["index", "source", "path", "image", "error"])
+BatchResult.__doc__ = """
+    Result of one input of a PilPlusBatch run
+
+    index: position of the input
+    source: the input if it was a path, None otherwise
+    path: path of the saved output, None if nothing was saved or the item failed
+    image: the resulting PilPlus when the run has no output, None otherwise
+    error: None, or the exception that stopped this item (its traceback text is in error.traceback)
+"""
+
+
+class _OperationRecorder():
+    """
+        Internal base class recording PilPlus operations to run later (PilPlusBatch, PilPlusVideo, TiledImage).
+        Subclasses set self.operations to a list and may restrict the operations with _get_operation_error.
+    """
+
+    def __getattr__(self, name):
+        """
+            Records calls of the operations, e.g. batch.resize(100) records resize(100). Calls can be chained.
+        """
+        if self._get_operation_error(name) is not None:
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            return self.add(name, *args, **kwargs)
+
+        return record
+
+    def add(self, name: str, *args, **kwargs):
+        """
+            Records the call of PilPlus method `name`
+
+            @param name: str
+                name of the method
+            @return: PilPlusBatch, PilPlusVideo or TiledImage
+                current object
+        """
+        error = self._get_operation_error(name)
+        if error is not None:
+            raise ValueError(error)
+
+        self.operations.append((name, args, kwargs))
+
+        return self
+
+    def _get_operation_error(self, name: str):
+        """
+            Internal function checking that `name` is an operation which can be recorded
+
+            @param name: str
+                name of the method
+            @return: str
+                why the operation can't be recorded, None if it can
+        """
+        if name.startswith("_") or not callable(getattr(PilPlus, name, None)):
+            return "Unknown PilPlus operation: " + str(name)
+
+        return None
+
+
+class PilPlusBatch(_OperationRecorder):
+    """
+        Runs the same recorded PilPlus operations over many images with a pool of processes.
+
+        Operations are recorded by calling PilPlus methods on the batch:
+
+            batch = PilPlusBatch("photos/*.jpg", processes=8)
+            batch.resize(800).sharpen()
+            for result in batch.run("outputs", quality=85):
+                if result.error is not None:
+                    print(result.source, result.error)
+    """
+
+    def __init__(self, inputs, processes=None, chunksize=16, max_in_flight=None, ordered=True, native_array=True, lazy=False) -> None:
+        """
+            @param inputs: str or iterable
+                a directory (its image files), a glob pattern, a single path, or an iterable of anything PilPlus can open.
+                Iterables are consumed as the run goes, so generators don't have to fit in memory
+            @param processes: int
+                number of worker processes. Default is the number of cpus, 0 runs everything in the current process
+            @param chunksize: int
+                number of inputs sent to a worker at once
+            @param max_in_flight: int
+                maximum number of chunks submitted but not yet collected, which bounds the memory used by pending inputs and results.
+                Default is twice the number of processes
+            @param ordered: bool
+                if True, results come in the order of the inputs, otherwise as soon as they are ready
+            @param native_array: bool
+                native array mode of the PilPlus images (see PilPlus)
+            @param lazy: bool
+                lazy mode of the PilPlus images, so the recorded operations are optimized (see PilPlus.run_pending), which
+                may change the pixels slightly. Default runs them exactly as recorded
+        """
+        self.inputs = inputs
+        self.processes = os.cpu_count() if processes is None else processes
+        self.chunksize = max(1, chunksize)
+        self.max_in_flight = max_in_flight if max_in_flight is not None else 2 * max(1, self.processes)
+        self.ordered = ordered
+        self.native_array = native_array
+        self.lazy = lazy
+
+        self.operations = []
+
+    def _iter_inputs(self):
+        """
+            Internal function for listing the inputs
+
+            @return: iterator
+        """
+        return _iter_image_inputs(self.inputs)
+
+    def _get_output_path(self, output, index: int, source) -> str:
+        """
+            Internal function for naming the output of one input
+
+            @param output: str or callable
+                directory, or function of (index, source) giving the path
+            @return: str
+        """
+        if callable(output):
+            return output(index, source)
+
+        if isinstance(source, (str, os.PathLike)):
+            return os.path.join(output, os.path.basename(os.fspath(source)))
+
+        return os.path.join(output, str(index) + ".png")
+
+    def run(self, output=None, replace_file=True, **save_options):
+        """
+            Runs the recorded operations over all the inputs. An error in one input is reported in its result and
+            doesn't stop the others.
+
+            @param output: str or callable
+                directory where the results are saved (under the input's file name, or "<index>.png" if the input isn't a path),
+                or a function of (index, source) giving the output path. If None, nothing is saved and the resulting PilPlus
+                images are returned in the results instead
+            @param replace_file: bool
+                passed to PilPlus.save
+            @param save_options:
+                other arguments of PilPlus.save, e.g. quality
+            @return: iterator
+                BatchResult of each input
+        """
+        save_options["replace_file"] = replace_file
+
+        def named(index, source):
+            name = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+            path = None if output is None else self._get_output_path(output, index, name)
+
+            return index, name, path, source
+
+        items = itertools.starmap(named, enumerate(self._iter_inputs()))
+        chunks = iter(lambda: list(itertools.islice(items, self.chunksize)), [])
+
+        arguments = (self.operations, save_options, self.native_array, self.lazy)
+
+        if self.processes == 0:
+            for chunk in chunks:
+                yield from _run_batch_chunk(chunk, *arguments)
+
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor = ProcessPoolExecutor(max_workers=self.processes)
+        pending = deque()
+
+        try:
+            for chunk in chunks:
+                try:
+                    future = executor.submit(_run_batch_chunk, chunk, *arguments)
+                except BrokenProcessPool:
+                    # a worker died: the chunks submitted to that pool are lost (see _collect), the next ones run on a new pool
+                    executor.shutdown()
+                    executor = ProcessPoolExecutor(max_workers=self.processes)
+                    future = executor.submit(_run_batch_chunk, chunk, *arguments)
+
+                pending.append((future, chunk))
+
+                while len(pending) >= self.max_in_flight:
+                    yield from self._collect(pending)
+
+            while pending:
+                yield from self._collect(pending)
+        finally:
+            executor.shutdown()
+
+    def _collect(self, pending: deque):
+        """
+            Internal function waiting for submitted chunks: the oldest one if ordered, otherwise any that are done
+
+            @param pending: deque
+                (future, chunk) of the submitted chunks
+            @return: iterator
+                BatchResult of the finished chunks
+        """
+        if self.ordered:
+            finished = [pending.popleft()]
+        else:
+            done, _ = wait([future for future, _ in pending], return_when=FIRST_COMPLETED)
+
+            finished = [job for job in pending if job[0] in done]
+            for job in finished:
+                pending.remove(job)
+
+        for future, chunk in finished:
+            try:
+                results = future.result()
+            except Exception as error:
+                # the whole chunk was lost (e.g. a worker died), every item of it gets the error
+                error.traceback = traceback.format_exc()
+                results = [BatchResult(index, name, None, None, error) for index, name, _, _ in chunk]
+
+            yield from results
+
+
+def _iter_image_inputs(inputs):
+    """
+        Internal function for listing image inputs: the image files of a directory (sorted), the files matching a glob pattern
+        (sorted), a single path, or the items of an iterable
+
+        @param inputs: str or iterable
+        @return: iterator
+    """
+    if isinstance(inputs, os.PathLike):
+        inputs = os.fspath(inputs)
+
+    if isinstance(inputs, str):
+        if os.path.isdir(inputs):
+            return iter(sorted(os.path.join(inputs, name) for name in os.listdir(inputs)
+                               if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS))
+
+        if glob.has_magic(inputs):
+            return iter(sorted(glob.glob(inputs)))
+
+        return iter([inputs])
+
+    return iter(inputs)
+
+
+def _run_batch_chunk(chunk: list, operations: list, save_options: dict, native_array: bool, lazy: bool) -> list:
+    """
+        Internal function running the operations of a PilPlusBatch over a chunk of inputs (in a worker process)
+
+        @param chunk: list
+            (index, name, output path, input) of each input
+        @return: list
+            BatchResult of each input
+    """
+    results = []
+
+    for index, name, path, source in chunk:
+        try:
+            img = _apply_operations(PilPlus(source, native_array=native_array, lazy=lazy), operations)
+
+            if path is None:
+                img.run_pending()
+                results.append(BatchResult(index, name, None, img, None))
+            else:
+                results.append(BatchResult(index, name, img.save(path, **save_options), None, None))
+
+        except Exception as error:
+            error.traceback = traceback.format_exc()
+
+            try:
+                pickle.dumps(error)
+            except Exception:
+                # sent back to the main process, so it has to be picklable
+                message = error.traceback
+                error = RuntimeError(repr(error))
+                error.traceback = message
+
+            results.append(BatchResult(index, name, None, None, error))
+
+    return results
+
+
+def _apply_operations(img: PilPlus, operations: list) -> PilPlus:
+    """
+        Internal function calling recorded operations on an image
+
+        @param img: PilPlus
+        @param operations: list
+            method names, or (name, args, kwargs) tuples
+        @return: PilPlus
+            the resulting image, `img` itself unless an operation gives a new image (e.g. get_canny_edges)
+    """
+    for operation in operations:
+        if isinstance(operation, str):
+            result = getattr(img, operation)()
+        else:
+            name, args, kwargs = operation
+            result = getattr(img, name)(*args, **kwargs)
+
+        if isinstance(result, PilPlus):
+            img = result
+
+    return img
+
+
+def map_threads(operations, images, max_workers=None, ordered=True, native_array=True, lazy=False, cv2_threads=None, max_in_flight=None):
+    """
+        Runs operations over many images on a pool of threads. Each image is worked on by a single thread
+        and inputs that are PilPlus images are copied first (see PilPlus.copy), so no mutable state is shared.
+        OpenCV and most numpy/PIL operations release the GIL, so this scales with the number of cores without
+        the cost of sending images to other processes (see PilPlusBatch for that).
+
+        @param operations: callable or list
+            function called with each PilPlus image, its return value is the result. Or a list of operations,
+            method names or (name, args, kwargs) tuples like ["sharpen", ("resize", (100,), {})], then the result is the PilPlus image
+        @param images: iterable
+            anything PilPlus can open, or PilPlus images
+        @param max_workers: int
+            number of threads. Default is the number of cpus
+        @param ordered: bool
+            if True, results come in the order of the images, otherwise as soon as they are ready
+        @param native_array: bool
+            native array mode of the images, which avoids PIL/numpy copies between opencv operations
+        @param lazy: bool
+            lazy mode of the images (see PilPlus.run_pending)
+        @param cv2_threads: int
+            if set, number of threads opencv may use inside each operation while the pool runs (the setting is global).
+            1 avoids starting more threads than there are cores
+        @param max_in_flight: int
+            maximum number of images read but not yet collected, which bounds the memory used. Default is twice the number of threads
+        @return: iterator
+            result of each image. An exception raised for an image is raised again when its result is reached
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+
+    def run(source):
+        if isinstance(source, PilPlus):
+            img = source.copy()
+            img.native_array = native_array
+            img.lazy = lazy
+        else:
+            img = PilPlus(source, native_array=native_array, lazy=lazy)
+
+        if callable(operations):
+            return operations(img)
+
+        return _apply_operations(img, operations).run_pending()
+
+    if cv2_threads is not None:
+        previous_threads = cv2.getNumThreads()
+        cv2.setNumThreads(cv2_threads)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+
+            for source in images:
+                pending.append(executor.submit(run, source))
+
+                while len(pending) >= max_in_flight:
+                    yield from _collect_futures(pending, ordered)
+
+            while pending:
+                yield from _collect_futures(pending, ordered)
+    finally:
+        if cv2_threads is not None:
+            cv2.setNumThreads(previous_threads)
+
+
+def _collect_futures(pending: deque, ordered: bool):
+    """
+        Internal function waiting for the oldest future if ordered, otherwise for any that are done
+
+        @param pending: deque
+            submitted futures
+        @return: iterator
+            their results
+    """
+    if ordered:
+        yield pending.popleft().result()
+        return
+
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+# fourcc of the videos written by PilPlusVideo, by extension (mp4v for the others)
+VIDEO_FOURCCS = {".avi": "MJPG", ".mkv": "XVID", ".webm": "VP80"}
+
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm", ".wmv", ".mpg", ".mpeg")
+
+
+class PilPlusVideo(_OperationRecorder):
+    """
+        Runs the same recorded PilPlus operations over the frames of a video (or of an image sequence), streaming:
+        frames are read, processed and written one after the other, so the memory used doesn't depend on the length of the clip.
+
+            video = PilPlusVideo("clip.mp4", threads=4)
+            video.resize(640).sharpen()
+            video.run("clip_small.mp4")          # or an image sequence: video.run("frames/%05d.png")
+
+            for frame in video.frames():         # or the resulting PilPlus frames
+                ...
+    """
+
+    def __init__(self, source, threads=0, max_in_flight=None, native_array=True, lazy=False) -> None:
+        """
+            @param source: str or iterable
+                path of a video file (read with opencv), or an image sequence: a directory (its image files, sorted),
+                a glob pattern, or an iterable of anything PilPlus can open
+            @param threads: int
+                number of frames processed at the same time on a pool of threads (see map_threads). 0 processes them
+                one by one in the current thread
+            @param max_in_flight: int
+                maximum number of frames read but not yet written. Default is twice the number of threads
+            @param native_array: bool
+                native array mode of the frames (see PilPlus)
+            @param lazy: bool
+                lazy mode of the frames (see PilPlus.run_pending)
+        """
+        self.source = source
+        self.threads = threads
+        self.max_in_flight = max_in_flight
+        self.native_array = native_array
+        self.lazy = lazy
+
+        self.operations = []
+
+    def is_video(self) -> bool:
+        """
+            Outputs whether the source is a video file (and not an image sequence)
+
+            @return: bool
+        """
+        source = self.source
+
+        if not isinstance(source, (str, os.PathLike)):
+            return False
+
+        source = os.fspath(source)
+        extension = os.path.splitext(source)[1].lower()
+
+        return extension in VIDEO_EXTENSIONS or (os.path.isfile(source) and extension not in IMAGE_EXTENSIONS)
+
+    def get_fps(self, default: float = 30.0) -> float:
+        """
+            Outputs the frame rate of the source video
+
+            @param default: float
+                frame rate of image sequences, and of videos that don't tell theirs
+            @return: float
+        """
+        if not self.is_video():
+            return default
+
+        capture = self._open_capture()
+        try:
+            return capture.get(cv2.CAP_PROP_FPS) or default
+        finally:
+            capture.release()
+
+    def _open_capture(self):
+        """
+            Internal function for opening the source video
+
+            @return: cv2.VideoCapture
+        """
+        capture = cv2.VideoCapture(os.fspath(self.source))
+
+        if not capture.isOpened():
+            capture.release()
+            raise ValueError("Could not open video: " + os.fspath(self.source))
+
+        return capture
+
+    def _iter_sources(self):
+        """
+            Internal function reading the frames one at a time: rgb arrays of the video's frames, or the inputs of the image sequence
+
+            @return: iterator
+        """
+        if not self.is_video():
+            yield from _iter_image_inputs(self.source)
+            return
+
+        capture = self._open_capture()
+
+        try:
+            while True:
+                read, frame = capture.read()
+
+                if not read:
+                    break
+
+                # opencv decodes to bgr, PilPlus works in rgb
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame) if frame.ndim == 3 else frame
+        finally:
+            capture.release()
+
+    def frames(self):
+        """
+            Runs the recorded operations over the frames, in order
+
+            @return: iterator
+                resulting PilPlus image of each frame
+        """
+        sources = self._iter_sources()
+
+        if self.threads == 0:
+            for source in sources:
+                yield _apply_operations(PilPlus(source, native_array=self.native_array, lazy=self.lazy), self.operations).run_pending()
+
+            return
+
+        yield from map_threads(self.operations, sources, max_workers=self.threads, ordered=True, native_array=self.native_array,
+                               lazy=self.lazy, max_in_flight=self.max_in_flight)
+
+    def run(self, output: str, fps: float = None, fourcc: str = None, **save_options) -> int:
+        """
+            Runs the recorded operations over the frames and writes the results, either as a video or as an image sequence
+
+            @param output: str
+                path of the video to write (its extension is one of VIDEO_EXTENSIONS), or of the image sequence: a pattern
+                with the frame number like "frames/%05d.png", or a directory (frames are then "000000.png", "000001.png"...)
+            @param fps: float
+                frame rate of the video. Default is the one of the source (see get_fps)
+            @param fourcc: str
+                codec of the video, e.g. "mp4v" or "MJPG". Default depends on the extension (see VIDEO_FOURCCS)
+            @param save_options:
+                arguments of PilPlus.save for image sequences, e.g. quality
+            @return: int
+                number of frames written
+        """
+        output = os.fspath(output)
+        extension = os.path.splitext(output)[1].lower()
+
+        if extension not in VIDEO_EXTENSIONS:
+            count = 0
+
+            for index, frame in enumerate(self.frames()):
+                path = output % index if "%" in output else os.path.join(output, "%06d.png" % index)
+                frame.save(path, replace_file=True, **save_options)
+                count += 1
+
+            return count
+
+        if fourcc is None:
+            fourcc = VIDEO_FOURCCS.get(extension, "mp4v")
+
+        if fps is None:
+            fps = self.get_fps()
+
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        writer = None
+        count = 0
+
+        try:
+            for frame in self.frames():
+                array = self._get_bgr_array(frame)
+                size = (array.shape[1], array.shape[0])
+
+                if writer is None:
+                    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+                    writer_size = size
+
+                    if not writer.isOpened():
+                        raise ValueError("Could not open video writer for " + output + " with fourcc " + fourcc)
+                elif size != writer_size:
+                    raise ValueError("All frames of a video must have the same size")
+
+                writer.write(array)
+                count += 1
+        finally:
+            if writer is not None:
+                writer.release()
+
+        return count
+
+    def _get_bgr_array(self, frame: PilPlus) -> np.ndarray:
+        """
+            Internal function for converting a resulting frame to the 3 channel bgr array opencv writes
+
+            @param frame: PilPlus
+            @return: np.ndarray
+        """
+        mode = frame._get_mode()
+
+        if mode == "L":
+            return cv2.cvtColor(frame.get_numpy_array(copy=False), cv2.COLOR_GRAY2BGR)
+
+        if mode == "RGBA":
+            return cv2.cvtColor(frame.get_numpy_array(copy=False), cv2.COLOR_RGBA2BGR)
+
+        return cv2.cvtColor(frame._get_rgb_array(), cv2.COLOR_RGB2BGR)
+
+
+class ResultCache():
+    """
+        Cache of encoded results of PilPlus operations, keyed by a hash of the input's content, the operations with all their
+        arguments and the output format. A hit returns the encoded bytes without decoding anything.
+
+            cache = ResultCache(directory="cache")
+            data = cache.render("image.jpg", [("resize", (800,), {}), "sharpen"], "JPEG", quality=85)
+
+        The memory tier keeps the most recently used results, the optional disk tier keeps results between runs (and can be
+        shared by processes), the least recently used ones are removed when it grows over its size.
+    """
+
+    # part of every key, to be changed when the same key would no longer give the same result
+    VERSION = 2
+
+    def __init__(self, max_items: int = 256, max_bytes: int = 64 * 1024 * 1024, directory: str = None, max_disk_bytes: int = 1024 * 1024 * 1024) -> None:
+        """
+            @param max_items: int
+                maximum number of results in memory
+            @param max_bytes: int
+                maximum total size of the results in memory
+            @param directory: str
+                directory of the disk tier. Default is no disk tier
+            @param max_disk_bytes: int
+                maximum total size of the files of the disk tier
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+
+        # key: file size, in least recently used order. Read from the directory on first use
+        self._disk = None
+        self._disk_bytes = 0
+
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def stats(self) -> dict:
+        """
+            Outputs the counters and sizes of the cache
+
+            @return: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk or ()),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def render(self, source, operations=(), format="JPEG", quality=None, subsampling=None, native_array=True) -> bytes:
+        """
+            Outputs `source` with `operations` run on it one by one (like the same calls on a PilPlus, without the
+            optimizations of lazy mode), encoded in `format`, from the cache if it's there
+
+            @param source: str, bytes, file-like object, np.ndarray, PIL.Image or PilPlus
+                anything PilPlus can open. Paths and file-like objects are read once, for both the hash and the decoding
+            @param operations: list
+                method names, or (name, args, kwargs) tuples like ["sharpen", ("resize", (100,), {})]. Their arguments must be
+                plain values (numbers, strings, None, and lists, tuples or dicts of them)
+            @param format: str
+            @param quality: int
+            @param subsampling: int or str
+                see encode
+            @param native_array: bool
+                native array mode of the image on a miss
+            @return: bytes
+                the encoded image
+        """
+        digest, source = self._hash_source(source)
+        key = self.get_key(digest, operations, format, quality, subsampling)
+
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        img = _apply_operations(PilPlus(source, native_array=native_array), operations)
+        data = img.encode(format, quality, subsampling)
+
+        self.put(key, data)
+
+        return data
+
+    def render_base64(self, source, operations=(), format="JPEG", quality=None, subsampling=None, native_array=True) -> bytes:
+        """
+            Same as render, but outputs the base64 data like PilPlus.return_base64
+
+            @return: bytes
+        """
+        return base64.b64encode(self.render(source, operations, format, quality, subsampling, native_array))
+
+    def get_key(self, digest: str, operations=(), format="JPEG", quality=None, subsampling=None) -> str:
+        """
+            Outputs the key of a result. Operations are described with all their arguments, defaults included,
+            so e.g. resize(100) and resize(new_width=100) have the same key
+
+            @param digest: str
+                hash of the input (see _hash_source)
+            @return: str
+        """
+        description = [ResultCache.VERSION, digest, self._describe_operations(operations),
+                       format.upper().replace("JPG", "JPEG"), quality, subsampling]
+
+        return hashlib.sha256(json.dumps(description, separators=(",", ":")).encode()).hexdigest()
+
+    def _describe_operations(self, operations) -> list:
+        """
+            Internal function for the canonical description of operations
+
+            @param operations: list
+            @return: list
+        """
+        described = []
+
+        for operation in operations:
+            name, args, kwargs = (operation, (), {}) if isinstance(operation, str) else operation
+
+            method = getattr(PilPlus, name, None)
+            if name.startswith("_") or not callable(method):
+                raise ValueError("Unknown PilPlus operation: " + str(name))
+
+            arguments = inspect.signature(method).bind(None, *args, **kwargs)
+            arguments.apply_defaults()
+
+            described.append([name, [[argument, self._describe_value(value)] for argument, value in arguments.arguments.items() if argument != "self"]])
+
+        return described
+
+    def _describe_value(self, value):
+        """
+            Internal function for the canonical description of an argument
+
+            @param value:
+            @return: json serializable value
+        """
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+
+        if _is_numpy(value, "generic"):
+            return value.item()
+
+        if isinstance(value, (tuple, list)):
+            return [self._describe_value(item) for item in value]
+
+        if isinstance(value, dict):
+            return sorted([self._describe_value(key), self._describe_value(item)] for key, item in value.items())
+
+        raise ValueError("Argument can't be part of a cache key: " + repr(type(value)))
+
+    def _hash_source(self, source) -> tuple:
+        """
+            Internal function hashing the content of the input
+
+            @param source:
+            @return: tuple(str, source)
+                the hash, and what PilPlus should open on a miss (the content read for the hash, if it was read from a file)
+        """
+        hasher = hashlib.blake2b(digest_size=32)
+
+        if isinstance(source, PilPlus):
+            source.run_pending()
+            source = source._get_array() if source._array is not None else source.img
+
+        if _is_numpy(source):
+            hasher.update(("array", source.shape, source.dtype.str).__repr__().encode())
+            hasher.update(np.ascontiguousarray(source).data)
+        elif isinstance(source, Image.Image):
+            hasher.update(("image", source.mode, source.size).__repr__().encode())
+            hasher.update(source.tobytes())
+        else:
+            if isinstance(source, os.PathLike) or (isinstance(source, str) and len(source) < _MAX_PATH_LENGTH and os.path.isfile(source)):
+                with open(source, "rb") as file:
+                    source = file.read()
+            elif hasattr(source, "read"):
+                source = source.read()
+
+            if isinstance(source, str):
+                # base64 or data url
+                hasher.update(b"text")
+                hasher.update(source.encode())
+            else:
+                hasher.update(b"bytes")
+                hasher.update(source)
+
+                if not isinstance(source, bytes):
+                    source = bytes(source)
+
+                source = BytesIO(source)
+
+        return hasher.hexdigest(), source
+
+    def get(self, key: str) -> bytes:
+        """
+            Outputs the cached result of `key`, None if it isn't cached
+
+            @param key: str
+            @return: bytes
+        """
+        with self._lock:
+            data = self._memory.get(key)
+
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+        data = self._read_disk(key)
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self._put_memory(key, data)
+
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+            Caches a result
+
+            @param key: str
+            @param data: bytes
+            @return: None
+        """
+        with self._lock:
+            self._put_memory(key, data)
+
+        self._write_disk(key, data)
+
+    def clear(self) -> None:
+        """
+            Removes every result, from memory and disk
+
+            @return: None
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+            if self.directory is not None:
+                for key in list(self._get_disk_index()):
+                    self._remove_disk(key)
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        """
+            Internal function adding a result to the memory tier (with the lock held)
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+
+        while len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes:
+            _, removed = self._memory.popitem(last=False)
+            self._memory_bytes -= len(removed)
+
+    def _get_disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _get_disk_index(self) -> OrderedDict:
+        """
+            Internal function for the index of the disk tier (with the lock held), read from the directory on first use
+
+            @return: OrderedDict
+        """
+        if self._disk is None:
+            files = []
+
+            if os.path.isdir(self.directory):
+                for folder in os.scandir(self.directory):
+                    if folder.is_dir():
+                        files.extend(entry for entry in os.scandir(folder.path) if entry.is_file() and not entry.name.endswith(".tmp"))
+
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+
+            self._disk = OrderedDict((entry.name, entry.stat().st_size) for entry in files)
+            self._disk_bytes = sum(self._disk.values())
+
+        return self._disk
+
+    def _read_disk(self, key: str) -> bytes:
+        """
+            Internal function reading a result from the disk tier
+
+            @return: bytes
+                None if it isn't there
+        """
+        if self.directory is None:
+            return None
+
+        path = self._get_disk_path(key)
+
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+
+            # recently used, for the eviction of other processes too
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            index = self._get_disk_index()
+
+            if key in index:
+                index.move_to_end(key)
+            else:
+                # written by another process
+                index[key] = len(data)
+                self._disk_bytes += len(data)
+
+        return data
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        """
+            Internal function writing a result to the disk tier, then removing the least recently used ones over max_disk_bytes
+        """
+        if self.directory is None or len(data) > self.max_disk_bytes:
+            return
+
+        path = self._get_disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temporary = path + "." + os.urandom(4).hex() + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+        with self._lock:
+            index = self._get_disk_index()
+
+            self._disk_bytes += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+
+            while self._disk_bytes > self.max_disk_bytes:
+                self._remove_disk(next(iter(index)))
+
+    def _remove_disk(self, key: str) -> None:
+        """
+            Internal function removing a result from the disk tier (with the lock held)
+        """
+        self._disk_bytes -= self._disk.pop(key)
+
+        try:
+            os.remove(self._get_disk_path(key))
+        except FileNotFoundError:
+            pass
+
+
+class TiledImage(_OperationRecorder):
+    """
+        Processing of images too large for memory. The image is read from a memory mapped file (.npy, uncompressed .tif/.tiff
+        or raw pixels) and the recorded operations run tile by tile, with enough overlap (halo) around each tile for operations
+        looking at neighbouring pixels. The result is written to disk tile by tile, so memory use depends on the tile size,
+        not on the image size.
+
+            tiled = TiledImage("scan.tif", tile_size=2048)
+            tiled.sharpen().replace_color((0, 0, 0), (255, 255, 255))
+            tiled.save("scan_sharp.tif")
+
+        Tiff files need the tifffile package.
+    """
+
+    # operation name: function of its (args, kwargs) giving the number of neighbouring pixels it reads on each side
+    HALOS = {
+        "convert_to_grayscale": lambda args, kwargs: 0,
+        "bgr_to_rgb": lambda args, kwargs: 0,
+        "rgb_to_bgr": lambda args, kwargs: 0,
+        "convert_to_rgb": lambda args, kwargs: 0,
+        "fill": lambda args, kwargs: 0,
+        "replace_color": lambda args, kwargs: 0,
+        "replace_colors": lambda args, kwargs: 0,
+        "sharpen": lambda args, kwargs: 1,
+        # PIL approximates the gaussian with 3 box blurs of about the radius each, the opencv kernels are 3 radii wide on each side.
+        # Downscaled blurs add the interpolation and aren't exactly the same as on the whole image
+        "apply_gaussian_blur": lambda args, kwargs: _gaussian_blur_halo(*args, **kwargs),
+        # sobel and non maximum suppression read 2 pixels, the halo also lets most edges continue across tiles
+        # (edge tracking is not bounded, so an edge only connected to a strong one more than this far away may differ)
+        "get_canny_edges": lambda args, kwargs: 16,
+    }
+
+    def __init__(self, path: str, shape: tuple = None, dtype="uint8", tile_size: int = 1024) -> None:
+        """
+            @param path: str
+                .npy, uncompressed .tif/.tiff, or a raw file of pixels (then `shape` and `dtype` are needed)
+            @param shape: tuple
+                (height, width) or (height, width, channels) of a raw file
+            @param dtype: np.dtype
+                pixel type of a raw file
+            @param tile_size: int
+                width and height of the tiles, without the halo
+        """
+        self.path = path
+        self.tile_size = tile_size
+
+        self.operations = []
+        self._array = self._open(path, shape, dtype)
+
+    @property
+    def shape(self) -> tuple:
+        return self._array.shape
+
+    def _open(self, path: str, shape: tuple, dtype) -> np.ndarray:
+        """
+            Internal function for memory mapping the input file
+
+            @return: np.memmap
+        """
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension == ".npy":
+            return np.load(path, mmap_mode="r")
+
+        if extension in (".tif", ".tiff"):
+            import tifffile
+
+            try:
+                return tifffile.memmap(path, mode="r")
+            except ValueError:
+                raise ValueError("Only uncompressed tiff files can be memory mapped: " + path)
+
+        if shape is None:
+            raise ValueError("shape of the raw file must be defined")
+
+        return np.memmap(path, dtype=dtype, mode="r", shape=tuple(shape))
+
+    def _create(self, path: str, shape: tuple, dtype) -> np.ndarray:
+        """
+            Internal function for creating a memory mapped output file, in the format of the extension of `path`
+
+            @return: np.memmap
+        """
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension == ".npy":
+            return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+        if extension in (".tif", ".tiff"):
+            import tifffile
+
+            return tifffile.memmap(path, shape=shape, dtype=dtype, photometric="rgb" if len(shape) == 3 and shape[2] in (3, 4) else "minisblack")
+
+        return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+
+    def _get_operation_error(self, name: str):
+        """
+            Internal function checking that `name` is an operation which can run tile by tile (see HALOS)
+
+            @param name: str
+                name of the method
+            @return: str
+                why the operation can't be recorded, None if it can
+        """
+        if name not in TiledImage.HALOS:
+            return "Operation can't run tile by tile: " + str(name)
+
+        return None
+
+    def get_halo(self) -> int:
+        """
+            Outputs the overlap needed around the tiles by the recorded operations
+
+            @return: int
+        """
+        return sum(TiledImage.HALOS[name](args, kwargs) for name, args, kwargs in self.operations)
+
+    def _process_tile(self, y: int, x: int, halo: int) -> np.ndarray:
+        """
+            Internal function running the operations on the tile at (y, x)
+
+            @param y: int
+            @param x: int
+            @param halo: int
+            @return: np.ndarray
+                processed tile, without its halo
+        """
+        height, width = self.shape[:2]
+
+        top, left = max(0, y - halo), max(0, x - halo)
+        bottom, right = min(height, y + self.tile_size + halo), min(width, x + self.tile_size + halo)
+
+        # reads only this part of the file
+        img = PilPlus(np.array(self._map_rows(self._array, top, bottom)[:, left:right]), native_array=True)
+
+        for name, args, kwargs in self.operations:
+            result = getattr(img, name)(*args, **kwargs)
+
+            # e.g. get_canny_edges gives a new image
+            if isinstance(result, PilPlus):
+                img = result
+
+        tile = img.get_numpy_array(copy=False)
+
+        return tile[y - top:y - top + min(self.tile_size, height - y), x - left:x - left + min(self.tile_size, width - x)]
+
+    def _map_rows(self, array: np.ndarray, top: int, bottom: int, mode="r") -> np.ndarray:
+        """
+            Internal function mapping rows top to bottom of a memory mapped file on their own. Pages read or written
+            through a mapping stay in memory as long as it exists, so each tile uses a short lived one
+
+            @param array: np.memmap
+            @param top: int
+            @param bottom: int
+            @param mode: str
+                "r" or "r+"
+            @return: np.ndarray
+        """
+        if not isinstance(array, np.memmap) or not array.flags.c_contiguous:
+            return array[top:bottom]
+
+        return np.memmap(array.filename, dtype=array.dtype, mode=mode, offset=array.offset + top * array.strides[0],
+                         shape=(bottom - top,) + array.shape[1:])
+
+    def save(self, path: str) -> str:
+        """
+            Runs the recorded operations tile by tile and writes the result to `path`. Its format is picked from the
+            extension like for the input (.npy, .tif/.tiff, anything else is raw pixels). The file only appears once complete.
+
+            @param path: str
+            @return: str
+                path of the saved file
+        """
+        height, width = self.shape[:2]
+        halo = self.get_halo()
+
+        tiles = ((y, x) for y in range(0, height, self.tile_size) for x in range(0, width, self.tile_size))
+
+        # the first tile tells the shape and type of the output (e.g. get_canny_edges gives one channel)
+        first = self._process_tile(0, 0, halo)
+
+        directory, name = os.path.split(path)
+        temporary = os.path.join(directory, "." + name + "." + os.urandom(4).hex() + ".tmp" + os.path.splitext(name)[1])
+
+        try:
+            output = self._create(temporary, (height, width) + first.shape[2:], first.dtype)
+
+            for y, x in tiles:
+                tile = first if (y, x) == (0, 0) else self._process_tile(y, x, halo)
+
+                rows = self._map_rows(output, y, y + tile.shape[0], mode="r+")
+                rows[:, x:x + tile.shape[1]] = tile
+
+                # unmapped right away, the written pages are left to the os
+                del rows
+
+            output.flush()
+            del output
+
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+        return path
+
+    def to_pilplus(self, native_array=True) -> PilPlus:
+        """
+            Outputs the image (with the recorded operations run on it) as a PilPlus. Only for images that fit in memory
+
+            @return: PilPlus
+        """
+        halo = self.get_halo()
+        height, width = self.shape[:2]
+
+        rows = [np.concatenate([self._process_tile(y, x, halo) for x in range(0, width, self.tile_size)], axis=1)
+                for y in range(0, height, self.tile_size)]
+
+        return PilPlus(np.concatenate(rows, axis=0), native_array=native_array)
+
+
+def _blur_downscale_factor(radius: float, downscale) -> int:
+    """
+        Internal function for the downscaling factor of apply_gaussian_blur
+
+        @param radius: float
+        @param downscale: bool or int
+        @return: int
+    """
+    if downscale is True:
+        return max(1, int(radius // 8))
+
+    return max(1, int(downscale or 1))
+
+
+def _gaussian_blur_halo(radius: float = 10, backend: str = "pil", downscale=None) -> int:
+    """
+        Internal function for the halo of apply_gaussian_blur in TiledImage
+
+        @return: int
+    """
+    factor = _blur_downscale_factor(radius, downscale)
+
+    return int(np.ceil(3 * radius)) + 3 + 2 * factor
+
+
+ProfileRecord = namedtuple("ProfileRecord", ["name", "wall_time", "cpu_time", "input_size", "output_size", "allocated_bytes", "peak_bytes",
+                                             "depth", "thread"])
+ProfileRecord.__doc__ = """
+    One call recorded by the profiling hooks (see add_profile_hook)
+
+    name: method name. Besides the public methods, "decode" is PIL decoding a file, "img" and "_get_array" the conversions
+          between PIL images and numpy arrays, "_encode_into" and "_write_atomically" the encoding of return_base64/encode and save
+    wall_time, cpu_time: seconds. CPU time is the one of the calling thread (threads started by opencv aren't counted)
+    input_size, output_size: (width, height) of the image before and after, None if unknown (e.g. operations still pending in lazy mode)
+    allocated_bytes, peak_bytes: memory still allocated after the call and highest memory use during it, above the one before the call.
+          Only when measured (see ProfileCollector), and only what tracemalloc sees (python and numpy, not PIL's own buffers)
+    depth: 0 for calls made from outside, 1 for the calls they make, and so on (so times of nested calls are also in their parents')
+    thread: name of the thread
+"""
+
+# internal functions that are worth timing on their own (conversions, decoding and encoding).
+# Stages with a condition are only reported when it is true, i.e. when they do some work instead of returning what they already have
+PROFILED_STAGES = {
+    "img": lambda self: self._img is None and self._array is not None,
+    "_get_array": lambda self: self._array is None and not self._pending,
+    "_encode_into": None,
+    "_write_atomically": None,
+}
+
+_profile_hooks = []
+_profile_memory_hooks = 0
+_profile_started_tracemalloc = False
+_profile_originals = {}
+_profile_lock = threading.Lock()
+_profile_state = threading.local()
+
+
+def add_profile_hook(hook, memory: bool = False) -> None:
+    """
+        Registers a function called with a ProfileRecord after every call of a PilPlus method. While no hook is registered,
+        the methods are the plain ones, so profiling costs nothing when it's not used
+
+        @param hook: callable
+        @param memory: bool
+            also measure allocated memory (with tracemalloc, which slows everything down)
+        @return: None
+    """
+    global _profile_memory_hooks, _profile_started_tracemalloc
+
+    with _profile_lock:
+        if not _profile_hooks:
+            _install_profiling()
+
+        _profile_hooks.append((hook, memory))
+
+        if memory:
+            _profile_memory_hooks += 1
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _profile_started_tracemalloc = True
+
+
+def remove_profile_hook(hook) -> None:
+    """
+        Unregisters a function registered with add_profile_hook
+
+        @param hook: callable
+        @return: None
+    """
+    global _profile_memory_hooks, _profile_started_tracemalloc
+
+    with _profile_lock:
+        for index, (registered, memory) in enumerate(_profile_hooks):
+            if registered == hook:
+                del _profile_hooks[index]
+                break
+        else:
+            raise ValueError("Hook is not registered")
+
+        if memory:
+            _profile_memory_hooks -= 1
+
+            if _profile_memory_hooks == 0 and _profile_started_tracemalloc:
+                tracemalloc.stop()
+                _profile_started_tracemalloc = False
+
+        if not _profile_hooks:
+            _uninstall_profiling()
+
+
+def _install_profiling() -> None:
+    """
+        Internal function replacing the public methods of PilPlus (and the stages in PROFILED_STAGES) with timed ones
+    """
+    for name, attribute in list(vars(PilPlus).items()):
+        if isinstance(attribute, property) and name in PROFILED_STAGES:
+            _profile_originals[name] = attribute
+            setattr(PilPlus, name, property(_profiled(name, attribute.fget, PROFILED_STAGES[name]), attribute.fset))
+        elif inspect.isfunction(attribute) and not inspect.iscoroutinefunction(attribute) \
+                and (not name.startswith("_") or name in PROFILED_STAGES):
+            _profile_originals[name] = attribute
+            setattr(PilPlus, name, _profiled(name, attribute, PROFILED_STAGES.get(name)))
+
+    # PIL calls load before most operations, only the first call decodes
+    _profile_originals["decode"] = ImageFile.ImageFile.load
+    ImageFile.ImageFile.load = _profiled("decode", ImageFile.ImageFile.load, lambda img: bool(img.tile))
+
+
+def _uninstall_profiling() -> None:
+    """
+        Internal function putting the original methods back
+    """
+    ImageFile.ImageFile.load = _profile_originals.pop("decode")
+
+    for name, attribute in _profile_originals.items():
+        setattr(PilPlus, name, attribute)
+
+    _profile_originals.clear()
+
+
+def _peek_size(img) -> tuple:
+    """
+        Internal function for the size of an image, without running anything (None if it isn't known without doing so)
+    """
+    if isinstance(img, PilPlus):
+        if img._pending:
+            return None
+        if img._array is not None:
+            return img._array.shape[1], img._array.shape[0]
+        img = img._img
+
+    if isinstance(img, Image.Image):
+        return img.size
+
+    return None
+
+
+def _profiled(name: str, function, condition=None):
+    """
+        Internal function wrapping `function` so that its calls are reported to the profiling hooks
+
+        @param name: str
+        @param function: callable
+        @param condition: callable
+            if given, calls are only reported when condition(self) is true
+    """
+    @wraps(function)
+    def profiled(self, *args, **kwargs):
+        if condition is not None and not condition(self):
+            return function(self, *args, **kwargs)
+
+        state = _profile_state
+        frames = getattr(state, "frames", None)
+        if frames is None:
+            frames = state.frames = []
+
+        measure_memory = _profile_memory_hooks > 0 and tracemalloc.is_tracing()
+        input_size = _peek_size(self)
+
+        frame = [0, 0]
+        if measure_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if frames:
+                # the peak is reset for this call, the parent keeps what it saw so far
+                frames[-1][1] = max(frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            frame = [current, current]
+
+        frames.append(frame)
+        wall, cpu = time.perf_counter(), time.thread_time()
+
+        try:
+            result = function(self, *args, **kwargs)
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            frames.pop()
+
+            allocated = peak_bytes = None
+            if measure_memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                frame[1] = max(frame[1], peak)
+                allocated, peak_bytes = current - frame[0], frame[1] - frame[0]
+
+                if frames:
+                    frames[-1][1] = max(frames[-1][1], frame[1])
+
+        output = result if isinstance(result, (PilPlus, Image.Image)) and result is not self else self
+        record = ProfileRecord(name, wall, cpu, input_size, _peek_size(output), allocated, peak_bytes, len(frames),
+                               threading.current_thread().name)
+
+        for hook, _ in list(_profile_hooks):
+            hook(record)
+
+        return result
+
+    return profiled
+
+
+class ProfileCollector():
+    """
+        Collects the profiling records of the PilPlus calls made while it is active
+
+            with ProfileCollector() as profile:
+                image = PilPlus("image.jpg")
+                image.resize(800)
+                image.save("out.jpg")
+
+            print(profile.summary())
+            profile.export("profile.jsonl")
+    """
+
+    def __init__(self, memory: bool = False) -> None:
+        """
+            @param memory: bool
+                also measure allocated memory (with tracemalloc, which slows everything down)
+        """
+        self.memory = memory
+        self.records = []
+
+        self._lock = threading.Lock()
+
+    def __call__(self, record: ProfileRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def __enter__(self) -> 'ProfileCollector':
+        add_profile_hook(self, memory=self.memory)
+
+        return self
+
+    def __exit__(self, *exc) -> None:
+        remove_profile_hook(self)
+
+    def to_dicts(self) -> list:
+        """
+            Outputs the records as dicts
+
+            @return: list
+        """
+        return [record._asdict() for record in self.records]
+
+    def get_totals(self, top_level_only: bool = False) -> dict:
+        """
+            Outputs totals per name: calls, wall_time, cpu_time and the largest peak_bytes
+
+            @param top_level_only: bool
+                only count the calls made from outside of PilPlus (depth 0)
+            @return: dict
+                name: dict of totals, by decreasing wall time
+        """
+        totals = {}
+
+        for record in self.records:
+            if top_level_only and record.depth > 0:
+                continue
+
+            total = totals.setdefault(record.name, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_bytes": None})
+            total["calls"] += 1
+            total["wall_time"] += record.wall_time
+            total["cpu_time"] += record.cpu_time
+
+            if record.peak_bytes is not None:
+                total["peak_bytes"] = max(total["peak_bytes"] or 0, record.peak_bytes)
+
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["wall_time"]))
+
+    def summary(self, top_level_only: bool = False) -> str:
+        """
+            Outputs a table of the totals per name (see get_totals)
+
+            @return: str
+        """
+        lines = ["%-28s %8s %12s %12s %12s %14s" % ("name", "calls", "wall (s)", "cpu (s)", "mean (ms)", "peak (bytes)")]
+
+        for name, total in self.get_totals(top_level_only).items():
+            lines.append("%-28s %8d %12.4f %12.4f %12.3f %14s" % (name, total["calls"], total["wall_time"], total["cpu_time"],
+                                                                   1000 * total["wall_time"] / total["calls"],
+                                                                   "" if total["peak_bytes"] is None else total["peak_bytes"]))
+
+        return "\n".join(lines)
+
+    def export(self, file, format: str = "jsonl") -> None:
+        """
+            Writes the records to a file, one per line
+
+            @param file: str or file-like object
+            @param format: str
+                "jsonl" (a json object per line) or "csv"
+            @return: None
+        """
+        if format not in ("jsonl", "csv"):
+            raise ValueError("Unknown export format: " + str(format))
+
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "w", newline="") as opened:
+                return self.export(opened, format)
+
+        if format == "jsonl":
+            for record in self.to_dicts():
+                file.write(json.dumps(record) + "\n")
+            return
+
+        writer = csv.writer(file)
+        writer.writerow(ProfileRecord._fields)
+
+        for record in self.records:
+            writer.writerow(["" if value is None else "x".join(map(str, value)) if isinstance(value, tuple) else value for value in record])
+
+
+_async_executor = None
+# thread pool created by _get_async_executor, shut down when set_async_executor replaces it
+_async_default_executor = None
+_async_max_concurrency = None
+_async_semaphores = weakref.WeakKeyDictionary()
+_async_lock = threading.Lock()
+
+
+def set_async_executor(executor=None, max_concurrency=None) -> None:
+    """
+        Configures where the awaitable methods (PilPlus.aopen, arun, aencode, asave) run their work
+
+        @param executor: concurrent.futures.Executor
+            Default is a thread pool with a thread per cpu, created on first use. The default thread pool is shut down when it is
+            replaced (operations already running finish), an executor given here is left for the caller to shut down
+        @param max_concurrency: int
+            maximum number of operations running at once in each event loop, others wait for their turn without blocking the loop.
+            Default is the number of cpus
+        @return: None
+    """
+    global _async_executor, _async_default_executor, _async_max_concurrency
+
+    with _async_lock:
+        default = _async_default_executor
+        _async_default_executor = None
+
+        _async_executor = executor
+        _async_max_concurrency = max_concurrency
+        _async_semaphores.clear()
+
+    if default is not None and default is not executor:
+        default.shutdown(wait=False)
+
+
+def _get_async_executor():
+    """
+        Internal function outputting the executor of the awaitable methods
+
+        @return: concurrent.futures.Executor
+    """
+    global _async_executor, _async_default_executor
+
+    with _async_lock:
+        if _async_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _async_executor = _async_default_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="pil_plus")
+
+        return _async_executor
+
+
+def _get_async_semaphore(loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+    """
+        Internal function outputting the concurrency limit of an event loop
+
+        @param loop: asyncio.AbstractEventLoop
+        @return: asyncio.Semaphore
+    """
+    with _async_lock:
+        semaphore = _async_semaphores.get(loop)
+
+        if semaphore is None:
+            semaphore = _async_semaphores[loop] = asyncio.Semaphore(_async_max_concurrency or os.cpu_count())
+
+        return semaphore
+
+
+async def _run_async(function, *args, **kwargs):
+    """
+        Internal function running function(*args, **kwargs) in the async executor, within the concurrency limit
+
+        @param function: callable
+        @return: its return value
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _get_async_semaphore(loop)
+
+    await semaphore.acquire()
+
+    try:
+        future = _get_async_executor().submit(function, *args, **kwargs)
+    except BaseException:
+        semaphore.release()
+        raise
+
+    def release(_):
+        # a cancelled call may still be running in its thread, the slot is only given back when it's really done
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            # the loop was closed in the meantime
+            pass
+
+    future.add_done_callback(release)
+
+    return await asyncio.wrap_future(future)
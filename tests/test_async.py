@@ -0,0 +1,45 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import pil_plus
+from pil_plus import PilPlus, set_async_executor
+
+
+@pytest.fixture(autouse=True)
+def default_executor():
+    set_async_executor()
+    yield
+    set_async_executor()
+
+
+def test_aencode_returns_base64_bytes():
+    img = PilPlus(np.zeros((20, 30, 3), dtype=np.uint8))
+
+    data = asyncio.run(img.aencode("PNG"))
+
+    assert isinstance(data, bytes)
+    assert data == img.return_base64("PNG")
+
+
+def test_replaced_default_executor_is_shut_down():
+    default = pil_plus._get_async_executor()
+
+    set_async_executor()
+
+    with pytest.raises(RuntimeError):
+        default.submit(int)
+
+
+def test_given_executor_is_not_shut_down():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        set_async_executor(executor)
+        img = PilPlus(np.zeros((20, 30, 3), dtype=np.uint8))
+
+        assert asyncio.run(img.aencode("PNG")) == img.return_base64("PNG")
+
+        set_async_executor()
+
+        assert executor.submit(int).result() == 0
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from pil_plus import BackgroundRemover, PilPlus, StubBackgroundRemover, get_background_remover, remove_backgrounds, set_background_remover
+
+
+class CountingRemover(StubBackgroundRemover):
+
+    def __init__(self, tolerance=30) -> None:
+        super().__init__(tolerance)
+        self.calls = []
+
+    def remove(self, images: list) -> list:
+        self.calls.append(len(images))
+
+        return super().remove(images)
+
+
+def make_array():
+    # white background with a red square
+    array = np.full((20, 30, 3), 255, dtype=np.uint8)
+    array[5:15, 10:20] = (200, 0, 0)
+
+    return array
+
+
+@pytest.fixture
+def stub():
+    backend = CountingRemover()
+    set_background_remover(backend)
+    yield backend
+    set_background_remover(None)
+
+
+def test_stub_output():
+    array = make_array()
+    array[0, 1] = (240, 250, 255)
+
+    result = StubBackgroundRemover(tolerance=20).remove([array])[0]
+
+    assert result.shape == (20, 30, 4)
+    assert np.array_equal(result[..., :3], array)
+    assert (result[5:15, 10:20, 3] == 255).all()
+    assert result[0, 0, 3] == 0 and result[0, 1, 3] == 0
+    assert (result[..., 3] == 255).sum() == 100
+
+
+def test_stub_tolerance():
+    array = make_array()
+    array[0, 1] = (240, 250, 255)
+
+    assert StubBackgroundRemover(tolerance=10).remove([array])[0][0, 1, 3] == 255
+
+
+@pytest.mark.parametrize("native_array", [True, False])
+def test_remove_background(stub, native_array):
+    img = PilPlus(make_array(), native_array=native_array)
+
+    img.remove_background()
+
+    assert get_background_remover() is stub
+    assert stub.calls == [1]
+    assert img.get_image().mode == "RGBA"
+    assert np.array_equal(img.get_numpy_array(), StubBackgroundRemover().remove([make_array()])[0])
+
+
+def test_remove_background_with_backend():
+    backend = CountingRemover()
+    img = PilPlus(make_array(), native_array=True)
+
+    img.remove_background(backend)
+    img.apply_background((0, 0, 255))
+
+    assert backend.calls == [1]
+    assert (img.get_numpy_array()[0, 0] == (0, 0, 255)).all()
+    assert (img.get_numpy_array()[10, 15] == (200, 0, 0)).all()
+
+
+def test_remove_backgrounds_is_one_batched_call(stub):
+    images = [PilPlus(make_array(), native_array=True) for _ in range(3)] + [PilPlus(make_array())]
+
+    assert remove_backgrounds(images) is images
+
+    assert stub.calls == [4]
+    for img in images:
+        assert np.array_equal(img.get_numpy_array(), StubBackgroundRemover().remove([make_array()])[0])
+
+
+def test_backend_must_implement_remove():
+    class NoRemove(BackgroundRemover):
+        pass
+
+    with pytest.raises(TypeError):
+        NoRemove()
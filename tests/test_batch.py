@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from pil_plus import PilPlus, PilPlusBatch
+
+
+class KillWorker:
+    """
+        Input whose unpickling in the worker process ends it
+    """
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def test_dead_worker_loses_only_its_chunk():
+    image = np.zeros((20, 30, 3), dtype=np.uint8)
+    inputs = [image, KillWorker(), image, image]
+
+    batch = PilPlusBatch(inputs, processes=1, chunksize=1, max_in_flight=1).resize(10)
+    results = list(batch.run())
+
+    assert [result.index for result in results] == [0, 1, 2, 3]
+    assert results[1].error is not None
+    assert [result.error for result in results[:1] + results[2:]] == [None, None, None]
+    assert [result.image.get_size() for result in results[2:]] == [(10, 6), (10, 6)]
+
+
+def test_run_in_current_process():
+    image = np.zeros((20, 30, 3), dtype=np.uint8)
+
+    results = list(PilPlusBatch([image, "missing.png"], processes=0).fill((1, 2, 3)).run())
+
+    assert results[0].error is None
+    assert (results[0].image.get_numpy_array() == (1, 2, 3)).all()
+    assert results[1].error is not None
+
+
+@pytest.mark.parametrize("processes", [0, 1])
+def test_batch_matches_calls_one_by_one(processes):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (60, 90, 3), dtype=np.uint8)
+
+    results = list(PilPlusBatch([image], processes=processes).sharpen().resize(20).run())
+
+    expected = PilPlus(image.copy()).sharpen().resize(20)
+
+    assert np.array_equal(results[0].image.get_numpy_array(), expected.get_numpy_array())
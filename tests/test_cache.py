@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pytest
+
+from pil_plus import PilPlus, ResultCache
+
+
+def make_array(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (60, 90, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def cache():
+    return ResultCache()
+
+
+def test_key_includes_defaults(cache):
+    key = cache.get_key("digest", [("resize", (100,), {})])
+
+    assert key == cache.get_key("digest", [("resize", (), {"new_width": 100})])
+    assert key == cache.get_key("digest", [("resize", (100, None), {})])
+    assert key != cache.get_key("digest", [("resize", (101,), {})])
+    assert key != cache.get_key("other", [("resize", (100,), {})])
+
+
+def test_key_canonical_values(cache):
+    assert cache.get_key("digest", ["sharpen"]) == cache.get_key("digest", [("sharpen", (), {})])
+    assert cache.get_key("digest", [], "jpg") == cache.get_key("digest", [], "JPEG")
+    assert cache.get_key("digest", [("fill", ((1, 2, 3),), {})]) == cache.get_key("digest", [("fill", ([1, 2, np.uint8(3)],), {})])
+    assert cache.get_key("digest", [("replace_colors", ({(0, 0, 0): (1, 1, 1), (2, 2, 2): (3, 3, 3)},), {})]) \
+        == cache.get_key("digest", [("replace_colors", ({(2, 2, 2): (3, 3, 3), (0, 0, 0): (1, 1, 1)},), {})])
+    assert cache.get_key("digest", [], "PNG", quality=80) != cache.get_key("digest", [], "PNG")
+
+
+def test_key_rejects_unknown_operations_and_values(cache):
+    with pytest.raises(ValueError):
+        cache.get_key("digest", ["_set_array"])
+
+    with pytest.raises(ValueError):
+        cache.get_key("digest", [("fill", (object(),), {})])
+
+
+def test_render_matches_calls_one_by_one(cache):
+    array = make_array()
+    operations = ["sharpen", ("resize", (30,), {})]
+
+    expected = PilPlus(array.copy()).sharpen().resize(30).encode("PNG")
+
+    assert cache.render(array, operations, "PNG") == expected
+    assert cache.render(array, operations, "PNG") == expected
+    assert (cache.misses, cache.memory_hits) == (1, 1)
+
+
+def test_same_content_hits(cache, tmp_path):
+    array = make_array()
+    path = tmp_path / "image.png"
+    PilPlus(array).save(str(path))
+
+    data = cache.render(str(path), ["sharpen"], "PNG")
+
+    with open(path, "rb") as file:
+        assert cache.render(file.read(), ["sharpen"], "PNG") == data
+
+    assert cache.hits == 1
+
+
+def test_memory_least_recently_used():
+    cache = ResultCache(max_items=2)
+
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1" and cache.get("c") == b"3"
+
+
+def test_memory_byte_limit():
+    cache = ResultCache(max_bytes=10)
+
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.put("c", b"1")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == b"12345"
+    assert cache.stats()["memory_bytes"] == 6
+
+    cache.put("large", b"x" * 11)
+    assert cache.get("large") is None
+
+
+def test_disk_hit_from_another_instance(tmp_path):
+    data = ResultCache(directory=str(tmp_path)).render(make_array(), ["sharpen"], "PNG")
+
+    other = ResultCache(directory=str(tmp_path))
+
+    assert other.render(make_array(), ["sharpen"], "PNG") == data
+    assert (other.disk_hits, other.misses) == (1, 0)
+
+    # now in memory too
+    other.render(make_array(), ["sharpen"], "PNG")
+    assert other.memory_hits == 1
+
+
+def test_disk_eviction(tmp_path):
+    cache = ResultCache(max_items=0, directory=str(tmp_path), max_disk_bytes=25)
+
+    for key in ("aa1", "bb2", "cc3"):
+        cache.put(key, b"x" * 10)
+
+    assert cache.stats()["disk_bytes"] == 20
+    assert not os.path.exists(os.path.join(str(tmp_path), "aa", "aa1"))
+    assert cache.get("aa1") is None
+
+    # read again, so bb2 is now the most recently used
+    assert cache.get("bb2") == b"x" * 10
+    cache.put("dd4", b"x" * 10)
+
+    assert cache.get("cc3") is None
+    assert cache.get("bb2") == b"x" * 10 and cache.get("dd4") == b"x" * 10
+
+
+def test_clear(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    cache.put("aa1", b"1")
+
+    cache.clear()
+
+    assert cache.get("aa1") is None
+    assert ResultCache(directory=str(tmp_path)).get("aa1") is None
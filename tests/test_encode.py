@@ -0,0 +1,53 @@
+import base64
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import pil_plus
+from pil_plus import PilPlus
+
+
+def make_image(width, height):
+    rng = np.random.default_rng(0)
+    return PilPlus(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def test_return_base64_round_trip():
+    img = make_image(40, 30)
+
+    data = img.return_base64("PNG")
+
+    assert np.array_equal(np.asarray(Image.open(BytesIO(base64.b64decode(data)))), img.get_numpy_array())
+    assert img.encode("PNG") == base64.b64decode(data)
+
+
+def test_small_encode_buffer_is_reused():
+    img = make_image(40, 30)
+
+    img.encode("PNG")
+    buffer = pil_plus._encode_buffers.buffer
+    img.return_base64("PNG")
+
+    assert pil_plus._encode_buffers.buffer is buffer
+
+
+def test_large_encode_buffer_is_dropped(monkeypatch):
+    monkeypatch.setattr(pil_plus, "ENCODE_BUFFER_LIMIT", 10000)
+
+    small, large = make_image(20, 20), make_image(200, 200)
+
+    assert large.return_base64("PNG") == base64.b64encode(large.encode("PNG"))
+    assert pil_plus._encode_buffers.buffer is None
+
+    small.encode("PNG")
+    assert pil_plus._encode_buffers.buffer is not None
+
+
+def test_given_buffer_is_kept(monkeypatch):
+    monkeypatch.setattr(pil_plus, "ENCODE_BUFFER_LIMIT", 10000)
+    buffer = BytesIO()
+
+    make_image(200, 200).return_base64("PNG", buffer=buffer)
+
+    assert buffer.getbuffer().nbytes > 10000
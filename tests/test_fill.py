@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from pil_plus import PilPlus
+
+
+def make_mask(height, width):
+    # smooth gradients, so that the luminosity paths are followed for a few pixels
+    rows, cols = np.mgrid[0:height, 0:width]
+    values = (128 + 100 * np.sin(rows / 5.0) * np.cos(cols / 7.0)).astype(np.uint8)
+
+    return np.stack([values, values // 2, 255 - values], axis=-1)
+
+
+@pytest.mark.parametrize("follow_limit", [0, 2, 5, 9])
+@pytest.mark.parametrize("y, x", [(0, 0), (3, 45), (20, 30), (39, 59), (25, 2)])
+def test_fill_surrounding_points_matches_whole_mask(y, x, follow_limit):
+    mask_img = make_mask(40, 60)
+    mask = PilPlus(mask_img, native_array=True)
+    img = PilPlus(np.zeros((40, 60, 3), dtype=np.uint8), native_array=True)
+
+    result = img.fill_surrounding_points(y, x, (2, 1), (1, 2, 3), np.zeros((40, 60, 3), dtype=np.uint8), mask, follow_limit=follow_limit)
+
+    expected = np.zeros((40, 60, 3), dtype=np.uint8)
+    img._follow_luminosity_fill(expected, mask_img, img._calculate_luminosity_array(mask_img), [(y, x, (2, 1), (1, 2, 3), 0)],
+                                follow_limit)
+
+    assert np.array_equal(result, expected)
+
+
+def test_fill_surrounding_points_updates_image():
+    img = PilPlus(np.zeros((40, 60, 3), dtype=np.uint8), native_array=True)
+    img.fill_surrounding_points(20, 30, (1, 1), (1, 2, 3), mask=PilPlus(make_mask(40, 60), native_array=True))
+
+    assert (img.get_numpy_array()[19:21, 29:31] == (1, 2, 3)).all()
+
+
+def test_fill_surrounding_points_outside_of_image():
+    img = np.zeros((40, 60, 3), dtype=np.uint8)
+
+    result = PilPlus(img.copy()).fill_surrounding_points(50, 30, (1, 1), (1, 2, 3), img, PilPlus(make_mask(40, 60)))
+
+    assert not result.any()
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("numpy", "cv2", "matplotlib")
+
+
+def run_python(code):
+    environment = dict(os.environ, PYTHONPATH=ROOT)
+
+    subprocess.run([sys.executable, "-c", textwrap.dedent(code)], check=True, env=environment, cwd=ROOT)
+
+
+def test_import_does_not_load_heavy_modules():
+    run_python("""
+        import sys
+        import pil_plus
+
+        loaded = [name for name in %r if name in sys.modules]
+        assert not loaded, loaded
+    """ % (HEAVY_MODULES,))
+
+
+def test_pil_only_operations_do_not_load_heavy_modules():
+    run_python("""
+        import sys
+        from PIL import Image
+        from pil_plus import PilPlus, map_threads
+
+        img = PilPlus(Image.new("RGB", (64, 48), "white"))
+        img.resize(32)
+        assert img.return_base64()
+
+        results = list(map_threads([("resize", (16,), {})], [Image.new("RGB", (64, 48))], max_workers=2, native_array=False))
+        assert results[0].get_size() == (16, 12)
+
+        loaded = [name for name in %r if name in sys.modules]
+        assert not loaded, loaded
+    """ % (HEAVY_MODULES,))
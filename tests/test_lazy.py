@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from pil_plus import PilPlus
+
+
+def make_array(channels):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (50, 60, channels), dtype=np.uint8)
+
+
+def run(array, operations, lazy, native_array=True):
+    img = PilPlus(array.copy(), native_array=native_array, lazy=lazy)
+
+    for name, args in operations:
+        getattr(img, name)(*args)
+
+    return img.get_numpy_array()
+
+
+# rewrites of run_pending that give exactly the result of running the calls one by one
+EXACT_CHAINS = [
+    (3, [("rgb_to_bgr", ()), ("bgr_to_rgb", ())]),
+    (3, [("rgb_to_bgr", ()), ("rgb_to_bgr", ()), ("fill", ((1, 2, 3),))]),
+    (4, [("rgb_to_bgr", ()), ("bgr_to_rgb", ())]),
+    (4, [("rgb_to_bgr", ()), ("bgr_to_rgb", ()), ("fill", ((1, 2, 3),))]),
+    (4, [("rgb_to_bgr", ()), ("rgb_to_bgr", ()), ("bgr_to_rgb", ())]),
+    (3, [("convert_to_rgb", ()), ("rgb_to_bgr", ())]),
+    (4, [("convert_to_rgb", ()), ("convert_to_rgb", ())]),
+    (3, [("convert_to_grayscale", ()), ("convert_to_grayscale", ())]),
+    (3, [("apply_background", ((255, 255, 255),)), ("rgb_to_bgr", ())]),
+    (4, [("apply_background", ((255, 255, 255),)), ("apply_background", ((0, 0, 0),))]),
+    (3, [("rgb_to_bgr", ()), ("resize", (20,))]),
+    (3, [("rgb_to_bgr", ()), ("bgr_to_rgb", ()), ("rgb_to_bgr", ()), ("resize", (30, 10))]),
+    (4, [("rgb_to_bgr", ()), ("resize", (20,))]),
+    (3, [("resize", (10,)), ("resize", (60,))]),
+    (3, [("resize", (90,)), ("resize", (20,))]),
+    (3, [("resize", (20,)), ("rgb_to_bgr", ()), ("resize", (40,))]),
+]
+
+
+@pytest.mark.parametrize("native_array", [True, False])
+@pytest.mark.parametrize("channels, operations", EXACT_CHAINS)
+def test_lazy_matches_eager(channels, operations, native_array):
+    array = make_array(channels)
+
+    eager = run(array, operations, lazy=False, native_array=native_array)
+    lazy = run(array, operations, lazy=True, native_array=native_array)
+
+    assert lazy.shape == eager.shape
+    assert np.array_equal(lazy, eager)
+
+
+def test_resize_of_gray_converted_to_rgb():
+    array = make_array(1)[..., 0]
+    operations = [("convert_to_rgb", ()), ("resize", (20,))]
+
+    assert np.array_equal(run(array, operations, lazy=True), run(array, operations, lazy=False))
+
+
+def test_merged_resizes_and_sharpen_keep_size():
+    array = make_array(3)
+    operations = [("sharpen", ()), ("resize", (40,)), ("resize", (20, 10))]
+
+    eager = run(array, operations, lazy=False)
+    lazy = run(array, operations, lazy=True)
+
+    assert lazy.shape == eager.shape == (10, 20, 3)
+
+
+def test_upscale_after_downscale_is_not_merged():
+    img = PilPlus(make_array(3), lazy=True)
+    img.resize(10).resize(60)
+
+    assert not np.array_equal(img.get_numpy_array(), make_array(3))
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+@pytest.mark.parametrize("native_array", [True, False])
+def test_operations_can_be_chained(lazy, native_array):
+    img = PilPlus(make_array(3), native_array=native_array, lazy=lazy)
+
+    result = img.resize(30).sharpen().rgb_to_bgr().bgr_to_rgb().rotate(90).fill((1, 2, 3)).replace_color((1, 2, 3), (4, 5, 6)) \
+        .apply_gaussian_blur(1).apply_background((0, 0, 0)).convert_to_rgb()
+
+    assert result is img
+    assert img.get_size() == (30, 25)
+
+
+def test_get_numpy_array_runs_pending():
+    img = PilPlus(np.zeros((40, 40, 3), dtype=np.uint8), native_array=True, lazy=True)
+    img.fill((1, 2, 3))
+
+    assert (img.get_numpy_array() == (1, 2, 3)).all()
+
+    img.resize(10)
+
+    assert img.get_numpy_array().shape == (10, 10, 3)
+    assert img.get_size() == (10, 10)
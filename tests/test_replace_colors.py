@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from pil_plus import PilPlus
+
+# (10, 0, 0) away from each other, so that pixels half way are at the same distance of both (ties)
+COLORS = {(100, 100, 100): (1, 1, 1), (110, 100, 100): (2, 2, 2), (105, 108, 100): (3, 3, 3), (0, 0, 0): (4, 4, 4), (255, 250, 255): (5, 5, 5)}
+
+
+def brute_force(array, colors, tolerance, metric):
+    result = array.copy()
+
+    for row in range(array.shape[0]):
+        for col in range(array.shape[1]):
+            pixel = array[row, col].astype(np.int64)
+            best = None
+
+            for source, target in colors.items():
+                difference = np.abs(pixel - np.array(source))
+                distance = difference.max() if metric == "channel" else np.sqrt((difference * difference).sum())
+
+                # the first of the closest colors wins
+                if distance <= tolerance and (best is None or distance < best[0]):
+                    best = (distance, target)
+
+            if best is not None:
+                result[row, col] = best[1]
+
+    return result
+
+
+def make_array(height, width):
+    # colors around the source colors, including the ones half way between two of them
+    rng = np.random.default_rng(0)
+    sources = np.array(list(COLORS), dtype=np.int64)
+    around = sources[rng.integers(0, len(sources), (height, width))] + rng.integers(-8, 9, (height, width, 3))
+
+    return np.clip(around, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("metric", ["channel", "euclidean"])
+@pytest.mark.parametrize("tolerance", [0, 4, 5, 7.5])
+@pytest.mark.parametrize("native_array", [True, False])
+def test_palette_matches_brute_force(metric, tolerance, native_array):
+    array = make_array(40, 50)
+
+    img = PilPlus(array, native_array=native_array).replace_colors(COLORS, tolerance, metric)
+
+    assert np.array_equal(img.get_numpy_array(), brute_force(array, COLORS, tolerance, metric))
+
+
+@pytest.mark.parametrize("metric", ["channel", "euclidean"])
+@pytest.mark.parametrize("tolerance", [5, 7.5])
+def test_lookup_table_matches_brute_force(metric, tolerance):
+    # large enough for the lookup table, the distinct colors are compared by brute force
+    array = make_array(1024, 512)
+    palette, inverse = np.unique(array.reshape(-1, 3), axis=0, return_inverse=True)
+
+    img = PilPlus(array, native_array=True).replace_colors(COLORS, tolerance, metric)
+
+    expected = brute_force(palette[np.newaxis], COLORS, tolerance, metric)[0][inverse.ravel()]
+    assert np.array_equal(img.get_numpy_array().reshape(-1, 3), expected)
+
+
+def test_ties_use_the_first_color():
+    array = np.array([[[105, 100, 100]]], dtype=np.uint8)
+
+    img = PilPlus(array).replace_colors({(100, 100, 100): (1, 1, 1), (110, 100, 100): (2, 2, 2)}, 5)
+
+    assert (img.get_numpy_array() == (1, 1, 1)).all()
+
+
+def test_gray_image():
+    array = np.arange(256, dtype=np.uint8).reshape(16, 16)
+
+    img = PilPlus(array).replace_colors({10: 0, 20: 255}, 3)
+
+    expected = array.copy()
+    expected[(array >= 7) & (array <= 13)] = 0
+    expected[(array >= 17) & (array <= 23)] = 255
+    assert np.array_equal(img.get_numpy_array(), expected)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from pil_plus import PilPlus
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (400, 600, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("native_array", [True, False])
+def test_resize_of_image_in_memory_is_exact(image, native_array):
+    img = PilPlus(image, native_array=native_array)
+    img.resize(60)
+
+    assert np.array_equal(img.get_numpy_array(), np.asarray(image.resize((60, 40), Image.LANCZOS)))
+
+
+def test_resize_of_opened_file_without_reduce_on_load_is_exact(image, tmp_path):
+    path = tmp_path / "image.png"
+    image.save(path)
+
+    img = PilPlus(str(path), reduce_on_load=False)
+    img.resize(60)
+
+    assert np.array_equal(img.get_numpy_array(), np.asarray(image.resize((60, 40), Image.LANCZOS)))
+
+
+def test_resize_of_opened_jpeg_is_reduced_on_load(image, tmp_path):
+    path = tmp_path / "image.jpg"
+    image.save(path)
+
+    img = PilPlus(str(path))
+    img.resize(60)
+
+    assert img.get_size() == (60, 40)
+
+
+@pytest.mark.parametrize("native_array", [True, False])
+def test_resize_after_an_operation_is_exact(image, tmp_path, native_array):
+    path = tmp_path / "image.jpg"
+    image.save(path)
+
+    img = PilPlus(str(path), native_array=native_array)
+    img.sharpen().resize(60)
+
+    expected = PilPlus(str(path), reduce_on_load=False).sharpen().resize(60)
+
+    assert np.array_equal(img.get_numpy_array(), expected.get_numpy_array())
+
+
+def test_thumbnail_is_the_three_calls(image):
+    expected = PilPlus(image.copy()).resize(60).sharpen().return_base64("PNG")
+
+    assert PilPlus(image.copy()).thumbnail(60, format="PNG") == expected
+
+
+def test_thumbnail_of_native_array_keeps_size(image):
+    img = PilPlus(np.asarray(image).copy(), native_array=True)
+
+    img.thumbnail(60, format="PNG")
+
+    assert img.get_size() == (60, 40)
+    assert img.get_numpy_array().shape == (40, 60, 3)
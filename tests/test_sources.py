@@ -0,0 +1,89 @@
+import base64
+import pathlib
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pil_plus import PilPlus
+
+
+@pytest.fixture
+def array():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def png(array):
+    buffer = BytesIO()
+    Image.fromarray(array).save(buffer, "PNG")
+
+    return buffer.getvalue()
+
+
+def url_safe_png(array):
+    # an image whose base64 has both "-" and "_"
+    for seed in range(100):
+        buffer = BytesIO()
+        Image.fromarray(np.roll(array, seed)).save(buffer, "PNG")
+        data = base64.urlsafe_b64encode(buffer.getvalue())
+
+        if b"-" in data and b"_" in data:
+            return np.roll(array, seed), data
+
+    raise AssertionError("no url-safe base64 with both characters")
+
+
+def source_cases(array, png, tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(png)
+    encoded = base64.b64encode(png)
+
+    return {
+        "path": str(path),
+        "pathlike": path,
+        "file": path,
+        "bytes": png,
+        "bytearray": bytearray(png),
+        "memoryview": memoryview(png),
+        "base64 text": encoded.decode(),
+        "base64 bytes": encoded,
+        "wrapped base64 text": base64.encodebytes(png).decode(),
+        "data url": "data:image/png;base64," + encoded.decode(),
+        "data url bytes": b"data:image/png;base64," + encoded,
+    }
+
+
+@pytest.mark.parametrize("case", ["path", "pathlike", "file", "bytes", "bytearray", "memoryview", "base64 text", "base64 bytes",
+                                  "wrapped base64 text", "data url", "data url bytes"])
+def test_get_source(case, array, png, tmp_path):
+    source = source_cases(array, png, tmp_path)[case]
+
+    if case == "file":
+        with open(source, "rb") as file:
+            assert np.array_equal(PilPlus(file).get_numpy_array(), array)
+    else:
+        assert np.array_equal(PilPlus(source).get_numpy_array(), array)
+
+
+@pytest.mark.parametrize("convert", [bytes.decode, bytes, memoryview, lambda data: "data:image/png;base64," + data.decode()])
+def test_url_safe_base64(array, convert):
+    expected, data = url_safe_png(array)
+
+    assert np.array_equal(PilPlus(convert(data)).get_numpy_array(), expected)
+
+
+def test_ascii_netpbm_bytes_are_an_image():
+    img = PilPlus(b"P3\n2 2\n255\n255 0 0 0 255 0\n0 0 255 255 255 255\n")
+
+    assert np.array_equal(img.get_numpy_array(), [[[255, 0, 0], [0, 255, 0]], [[0, 0, 255], [255, 255, 255]]])
+
+
+def test_existing_path_wins_over_base64(tmp_path, png, array, monkeypatch):
+    # a file name that is also valid base64
+    monkeypatch.chdir(tmp_path)
+    pathlib.Path("abcd").write_bytes(png)
+
+    assert np.array_equal(PilPlus("abcd").get_numpy_array(), array)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from pil_plus import PilPlus, TiledImage
+
+# doesn't divide the image size, so the last row and column of tiles are smaller
+TILE_SIZE = 48
+
+OPERATIONS = {
+    "sharpen": [("sharpen", (), {})],
+    "blur pil": [("apply_gaussian_blur", (3,), {"backend": "pil"})],
+    "blur cv2": [("apply_gaussian_blur", (3,), {"backend": "cv2"})],
+    "blur box": [("apply_gaussian_blur", (3,), {"backend": "box"})],
+    "canny": [("get_canny_edges", (), {})],
+    "colors": [("replace_color", ((0, 0, 0), (1, 2, 3)), {}), ("sharpen", (), {}), ("rgb_to_bgr", (), {})],
+}
+
+
+def make_array(height=130, width=170):
+    # shapes on a gradient, with some noise
+    rows, cols = np.mgrid[0:height, 0:width]
+    array = np.stack([rows * 255 // height, cols * 255 // width, (rows + cols) % 256], axis=-1).astype(np.int64)
+    array[20:60, 30:100] = (200, 30, 30)
+    array[(rows - 90) ** 2 + (cols - 120) ** 2 < 25 ** 2] = (0, 0, 0)
+
+    rng = np.random.default_rng(0)
+    array += rng.integers(-5, 6, array.shape)
+
+    return np.clip(array, 0, 255).astype(np.uint8)
+
+
+def whole_image(array, operations):
+    img = PilPlus(array.copy(), native_array=True)
+
+    for name, args, kwargs in operations:
+        result = getattr(img, name)(*args, **kwargs)
+
+        if isinstance(result, PilPlus):
+            img = result
+
+    return img.get_numpy_array()
+
+
+def record(tiled, operations):
+    for name, args, kwargs in operations:
+        tiled.add(name, *args, **kwargs)
+
+    return tiled
+
+
+@pytest.mark.parametrize("case", list(OPERATIONS))
+def test_npy_tiles_match_whole_image(case, tmp_path):
+    array = make_array()
+    np.save(tmp_path / "input.npy", array)
+
+    tiled = record(TiledImage(str(tmp_path / "input.npy"), tile_size=TILE_SIZE), OPERATIONS[case])
+    tiled.save(str(tmp_path / "output.npy"))
+
+    expected = whole_image(array, OPERATIONS[case])
+
+    assert np.array_equal(np.load(tmp_path / "output.npy"), expected)
+    assert np.array_equal(tiled.to_pilplus().get_numpy_array(), expected)
+
+
+@pytest.mark.parametrize("case", ["sharpen", "canny"])
+def test_raw_tiles_match_whole_image(case, tmp_path):
+    array = make_array()
+    array.tofile(tmp_path / "input.raw")
+
+    tiled = record(TiledImage(str(tmp_path / "input.raw"), shape=array.shape, tile_size=TILE_SIZE), OPERATIONS[case])
+    tiled.save(str(tmp_path / "output.raw"))
+
+    expected = whole_image(array, OPERATIONS[case])
+
+    assert np.array_equal(np.fromfile(tmp_path / "output.raw", dtype=np.uint8).reshape(expected.shape), expected)
+
+
+def test_raw_file_needs_shape(tmp_path):
+    make_array().tofile(tmp_path / "input.raw")
+
+    with pytest.raises(ValueError):
+        TiledImage(str(tmp_path / "input.raw"))
+
+
+def test_only_tile_operations_are_recorded(tmp_path):
+    np.save(tmp_path / "input.npy", make_array())
+    tiled = TiledImage(str(tmp_path / "input.npy"))
+
+    with pytest.raises(ValueError):
+        tiled.add("resize", 10)
+
+    with pytest.raises(AttributeError):
+        tiled.resize(10)